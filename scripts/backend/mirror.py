@@ -0,0 +1,90 @@
+import numpy
+
+from itertools import product
+
+from .topology import foreach_get_array, get_object_geometry_version
+
+
+mirror_cache = {}
+
+
+def get_ranks(values, distinct):
+    # Ranks of the values among the sorted distinct ones, -1 for values missing from them
+    ranks = numpy.minimum(numpy.searchsorted(distinct, values), distinct.size - 1)
+    return numpy.where(distinct[ranks] == values, ranks, -1)
+
+
+class MeshMirror:
+    def __init__(self, key, mesh, axis, tolerance=0.0001):
+        # Vert index to the index of the nearest vert mirrored through the object axis, -1 for verts without a mirror
+        # within the tolerance. Verts are bucketed in cells twice the tolerance wide, the mirror of a vert is in the
+        # cell of its mirrored co or in the neighbour cells on the nearer side along each axis.
+        self.key = key
+        co = foreach_get_array(mesh.vertices, "co", numpy.float32, 3).astype(numpy.float64)
+        self.verts_mirror = numpy.full(len(co), -1, dtype=numpy.int64)
+        if not len(co):
+            return
+
+        # Cells are keyed by the ranks of their values among the used ones, so the keys do not overflow
+        cell_size = tolerance * 2.0
+        cells = numpy.floor(co / cell_size).astype(numpy.int64)
+        distinct, ranks = zip(*(numpy.unique(cells[:, i], return_inverse=True) for i in range(3)))
+        distinct_xy, ranks_xy = numpy.unique(ranks[0] * distinct[1].size + ranks[1], return_inverse=True)
+        keys = ranks_xy.ravel() * distinct[2].size + ranks[2].ravel()
+        order = numpy.argsort(keys, kind="stable")
+        keys_sorted = keys[order]
+        keys_end = numpy.searchsorted(keys_sorted, keys_sorted, side="right")
+
+        mirror_co = co.copy()
+        mirror_co[:, axis] *= -1.0
+        mirror_cell_co = mirror_co / cell_size
+        mirror_cells = numpy.floor(mirror_cell_co).astype(numpy.int64)
+        sides = numpy.where(mirror_cell_co - mirror_cells < 0.5, -1, 1)
+        mirror_ranks = [[get_ranks(mirror_cells[:, i] + sides[:, i] * offset, distinct[i]) for offset in (0, 1)]
+                        for i in range(3)]
+
+        distances = numpy.full(len(co), numpy.inf)
+        for offset_x, offset_y, offset_z in product((0, 1), repeat=3):
+            rank_x, rank_y, rank_z = mirror_ranks[0][offset_x], mirror_ranks[1][offset_y], mirror_ranks[2][offset_z]
+            verts = numpy.flatnonzero((rank_x >= 0) & (rank_y >= 0) & (rank_z >= 0))
+            rank_xy = get_ranks(rank_x[verts] * distinct[1].size + rank_y[verts], distinct_xy)
+            verts, rank_xy = verts[rank_xy >= 0], rank_xy[rank_xy >= 0]
+            query_keys = rank_xy * distinct[2].size + rank_z[verts]
+            positions = numpy.minimum(numpy.searchsorted(keys_sorted, query_keys), keys_sorted.size - 1)
+            found = keys_sorted[positions] == query_keys
+            verts, positions = verts[found], positions[found]
+
+            # Verts sharing a cell are compared one at a time
+            while verts.size:
+                candidates = order[positions]
+                candidates_distance = numpy.linalg.norm(co[candidates] - mirror_co[verts], axis=1)
+                closer = (candidates_distance <= tolerance) & (candidates_distance < distances[verts])
+                distances[verts[closer]] = candidates_distance[closer]
+                self.verts_mirror[verts[closer]] = candidates[closer]
+
+                positions += 1
+                remaining = positions < keys_end[positions - 1]
+                verts, positions = verts[remaining], positions[remaining]
+
+    def mirror_verts_mask(self, verts_mask):
+        mirrored = verts_mask & (self.verts_mirror >= 0)
+        verts_mask = verts_mask.copy()
+        verts_mask[self.verts_mirror[mirrored]] = True
+        return verts_mask
+
+
+def get_mesh_mirror(obj, bm, axis, mesh_synced=False):
+    # Maps depend on the vert positions only
+    key = len(bm.verts), get_object_geometry_version(obj)
+    cache_key = (obj.data.as_pointer(), axis)
+    mirror = mirror_cache.get(cache_key)
+    if mirror is None or mirror.key != key:
+        if not mesh_synced:
+            obj.update_from_editmode()
+        mirror = MeshMirror(key, obj.data, axis)
+        mirror_cache[cache_key] = mirror
+    return mirror
+
+
+def free_mesh_mirrors():
+    mirror_cache.clear()
@@ -0,0 +1,128 @@
+import bmesh
+import numpy
+
+from .topology import foreach_get_array, csr_offsets, csr_ranges, get_mesh_version
+from .utils import points_3d_to_region_2d
+
+
+region_projection_cache = {}
+
+
+class RegionProjection:
+    def __init__(self, key, bms, region, perspective_matrix, margin=0.0, cell_size=32):
+        self.key = key
+        self.margin = margin
+        # BMesh wrappers are fetched again on each lookup, they are removed when the edit mode is toggled
+        self.objects = list(bms.keys())
+
+        verts_co = []
+        verts_normal = []
+        verts_hide = []
+        for obj in self.objects:
+            obj.update_from_editmode()
+            co = foreach_get_array(obj.data.vertices, "co", numpy.float32, 3)
+            mtx = numpy.array(obj.matrix_world, dtype=numpy.float64)
+            verts_co.append(co @ mtx[:3, :3].T + mtx[:3, 3])
+            verts_normal.append(foreach_get_array(obj.data.vertices, "normal", numpy.float32, 3))
+            verts_hide.append(foreach_get_array(obj.data.vertices, "hide", bool))
+        self.object_offsets = numpy.cumsum([0] + [len(co) for co in verts_co])
+
+        self.co = numpy.concatenate(verts_co) if verts_co else numpy.empty((0, 3))
+        self.normals = numpy.concatenate(verts_normal) if verts_normal else numpy.empty((0, 3), dtype=numpy.float32)
+        self.co_2d, self.valid = points_3d_to_region_2d(self.co, region, perspective_matrix)
+        if verts_hide:
+            self.valid &= ~numpy.concatenate(verts_hide)
+
+        # Uniform grid over the region grown by the margin, visible verts inside it bucketed by cell in row major
+        # order. Queries reaching past the margin are clamped to the border cells.
+        self.cell_size = cell_size
+        self.grid_origin = numpy.array((-margin, -margin))
+        self.grid_size = (int((region.width + margin * 2) // cell_size) + 1,
+                          int((region.height + margin * 2) // cell_size) + 1)
+        inside = ((self.co_2d >= -margin) & (self.co_2d <= (region.width + margin, region.height + margin))).all(axis=1)
+        visible = numpy.flatnonzero(self.valid & inside)
+        cells = self._cells(self.co_2d[visible])
+        cells = cells[:, 1] * self.grid_size[0] + cells[:, 0]
+        order = numpy.argsort(cells, kind="stable")
+        self.cell_offsets = csr_offsets(cells, self.grid_size[0] * self.grid_size[1])
+        self.cell_verts = visible[order]
+
+    def _cells(self, co):
+        cells = numpy.floor_divide(co - self.grid_origin, self.cell_size).astype(numpy.int64)
+        return numpy.clip(cells, 0, numpy.array(self.grid_size) - 1)
+
+    def _find_in_box(self, co_min, co_max):
+        # Visible verts of the cells covering the box
+        (x0, y0), (x1, y1) = self._cells(numpy.array((co_min, co_max)))
+        rows = numpy.arange(y0, y1 + 1) * self.grid_size[0]
+        starts = self.cell_offsets[rows + x0]
+        return self.cell_verts[csr_ranges(starts, self.cell_offsets[rows + x1 + 1] - starts)]
+
+    def find_range_indices(self, co, radius):
+        # Visible verts around co, in no particular order, with their squared distances
+        indices = self._find_in_box((co[0] - radius, co[1] - radius), (co[0] + radius, co[1] + radius))
+        offsets = self.co_2d[indices] - (co[0], co[1])
+        distances_squared = numpy.einsum("ij,ij->i", offsets, offsets)
+        in_range = distances_squared <= radius * radius
+        return indices[in_range], distances_squared[in_range]
+
+    def split_indices(self, indices):
+        # Global vert indices as (obj, bm, object vert indices) per object
+        for object_index, (start, end) in enumerate(zip(self.object_offsets[:-1], self.object_offsets[1:])):
+            object_indices = indices[(indices >= start) & (indices < end)] - start
+            if object_indices.size:
+                obj = self.objects[object_index]
+                yield obj, bmesh.from_edit_mesh(obj.data), object_indices
+
+    def get_object_verts(self, obj):
+        # World and region coordinates of the object verts, indexed like its mesh verts
+        object_index = self.objects.index(obj)
+        start, end = self.object_offsets[object_index:object_index + 2]
+        return self.co[start:end], self.co_2d[start:end], self.valid[start:end]
+
+    def get_object_normals(self, obj):
+        # Object space vert normals
+        object_index = self.objects.index(obj)
+        start, end = self.object_offsets[object_index:object_index + 2]
+        return self.normals[start:end]
+
+    def get_verts_select(self, indices):
+        # Current selection of the verts, read from the edit meshes of their objects
+        object_indices = numpy.searchsorted(self.object_offsets, indices, side="right") - 1
+        verts_select = numpy.zeros(indices.size, dtype=bool)
+        for object_index in numpy.unique(object_indices).tolist():
+            obj = self.objects[object_index]
+            obj.update_from_editmode()
+            in_object = object_indices == object_index
+            select = foreach_get_array(obj.data.vertices, "select", bool)
+            verts_select[in_object] = select[indices[in_object] - self.object_offsets[object_index]]
+        return verts_select
+
+    def get_vert(self, index):
+        object_index = int(numpy.searchsorted(self.object_offsets, index, side="right")) - 1
+        obj = self.objects[object_index]
+        bm = bmesh.from_edit_mesh(obj.data)
+        bm.verts.ensure_lookup_table()
+        return obj, bm, bm.verts[index - int(self.object_offsets[object_index])]
+
+
+def get_region_projection_key(region, rv3d, bms):
+    return (tuple(map(tuple, rv3d.perspective_matrix)), region.width, region.height,
+            tuple((obj.as_pointer(), get_mesh_version(obj, bm), tuple(map(tuple, obj.matrix_world)))
+                  for obj, bm in bms.items()))
+
+
+def get_region_projection(region, rv3d, bms, margin=0.0):
+    # Projected verts of the edited objects, cached per region until the view or the meshes change or queries need a
+    # wider margin around the region
+    key = get_region_projection_key(region, rv3d, bms)
+    region_pointer = region.as_pointer()
+    projection = region_projection_cache.get(region_pointer)
+    if projection is None or projection.key != key or projection.margin < margin:
+        projection = RegionProjection(key, bms, region, rv3d.perspective_matrix, margin)
+        region_projection_cache[region_pointer] = projection
+    return projection
+
+
+def free_region_projections():
+    region_projection_cache.clear()
@@ -1,14 +1,23 @@
 import bpy
 import bmesh
+import numpy
+import time
+from itertools import chain
+from mathutils import Vector
 from . import get_backend_module
+from .topology import (get_mesh_topology, get_mesh_normals, get_mesh_version, freeze_objects_geometry_version,
+                       foreach_get_array, label_components)
+from .projection import get_region_projection
+from .mirror import get_mesh_mirror
+from .snap import get_snap_bvhs
 
-from .utils import (matrix_decompose_4x4, is_backface,
-                    create_kdtree, intersect_point_section_2d,
-                    points_3d_to_region_2d, points_pairs_3d_to_region_2d,
-                    region_2d_to_points_3d)
+from .utils import (matrix_decompose_4x4, backface_culling_mask, get_eye_location, get_aligned_perspective_matrix,
+                    closest_points_on_sections_2d,
+                    points_3d_to_region_2d,
+                    region_2d_to_points_3d, region_2d_to_ray_3d)
 
 from ..user_interface import perfect_select_draw_callback
-from ..previews import get_selection_pattern_buffer
+from ..previews import get_selection_pattern_buffer, get_selection_pattern_sat, get_preview_version
 
 #
 # Extend to edge loops functions
@@ -35,75 +44,314 @@ def cpp_extend_to_edge_loops(context, operator):
 
 def py_extend_to_edge_loops(context, operator):
     prop_inner = operator.inner
-    mesh_select_mode = context.tool_settings.mesh_select_mode[:]
 
-    obj_selected_faces = []
-    obj_bm = []
     for obj in context.objects_in_mode_unique_data:
-        obj.update_from_editmode()
         bm = bmesh.from_edit_mesh(obj.data)
-        obj_selected_faces.append([f for f in bm.faces if f.select])
-        obj_bm.append(bm)
-
-    obj_boundary_edges = get_region_to_loop_edges(obj_bm)
-    obj_loop_edges = get_loop_edges(obj_bm)
+        obj.update_from_editmode()
+        topology = get_mesh_topology(obj, bm, mesh_synced=True)
 
-    bpy.ops.mesh.select_all(action='DESELECT')
-    context.tool_settings.mesh_select_mode = mesh_select_mode
+        face_select = foreach_get_array(obj.data.polygons, "select", bool)
+        edge_hide = foreach_get_array(obj.data.edges, "hide", bool)
+        boundary_edges = get_region_to_loop_edges(topology, face_select)
+        loop_edges = get_loop_edges(topology, boundary_edges, edge_hide)
 
-    for idx, bm in enumerate(obj_bm):
         if prop_inner:
-            select_faces_in_boundary_loop(bm, obj_selected_faces[idx], obj_boundary_edges[idx], obj_loop_edges[idx])
+            select_faces_in_boundary_loop(bm, topology, face_select, boundary_edges, loop_edges)
         else:
-            select_faces_out_boundary_loop(bm, obj_selected_faces[idx], obj_boundary_edges[idx], obj_loop_edges[idx])
+            select_faces_out_boundary_loop(bm, topology, face_select, boundary_edges, loop_edges)
+        bmesh.update_edit_mesh(obj.data, loop_triangles=False, destructive=False)
 
     return {'FINISHED'}
 
 
-def select_faces_in_boundary_loop(bm, selected_faces, boundary_edges, loop_edges):
-    pass
+def select_faces_in_boundary_loop(bm, topology, face_select, boundary_edges, loop_edges):
+    selected = face_select.copy()
+    boundary = boundary_edges
+    while True:
+        peeled = faces_in_to_boundary_loop__iter_cuts(topology, selected, boundary, loop_edges)
+        if not peeled.size:
+            break
+        selected[peeled] = False
+        boundary = get_region_to_loop_edges(topology, selected)
+
+    faces_deselect(bm, topology, face_select, face_select & ~selected)
+
+
+def faces_in_to_boundary_loop__iter_cuts(topology, selected, boundary, loop_edges):
+    # Inverse of the out pass. A cut is a run of loop edges inside the region between two boundary verts, which goes
+    # on as a boundary edge past at least one of its ends. The faces of those boundary edges are on the inner side of
+    # the cut, the outer side sticks out of the region. Cuts meeting at an end vert are alternatives of each other,
+    # only the shortest one is peeled, so a protrusion is peeled at its base and not along the loops through it.
+    topology.ensure_edge_loops()
+    edge_selected_faces = numpy.bincount(topology.loop_edge[selected[topology.loop_face]], minlength=topology.edges_len)
+    inner = loop_edges & ~boundary & (edge_selected_faces == 2) & (topology.edge_faces_len == 2)
+    edges = numpy.flatnonzero(inner)
+    if not edges.size:
+        return edges
+
+    # Inner edges are joined to their neighbours along the loop into runs
+    edge_index = numpy.full(topology.edges_len, -1, dtype=numpy.int64)
+    edge_index[edges] = numpy.arange(edges.size)
+    next_edges = topology.edge_vert_next[edges]
+    next_index = numpy.where(next_edges >= 0, edge_index[next_edges], -1)
+    linked = next_index >= 0
+    cuts = label_components(edges.size, numpy.nonzero(linked)[0], next_index[linked])
+
+    # Faces on the left and on the right of the edges, in the walking direction of their loop
+    start_vert = topology.edge_verts[edges, topology.edge_loop_side[edges]]
+    loops_a = topology.edge_loops[topology.edge_loop_offsets[edges]]
+    loops_b = topology.loop_radial_next[loops_a]
+    is_forward_a = topology.loop_vert[loops_a] == start_vert
+    left_face = numpy.where(is_forward_a, topology.loop_face[loops_a], topology.loop_face[loops_b])
+    right_face = numpy.where(is_forward_a, topology.loop_face[loops_b], topology.loop_face[loops_a])
+    is_oriented = is_forward_a != (topology.loop_vert[loops_b] == start_vert)
+
+    # Ends going on as boundary edges tell the outer side and have to agree on it, the other ends have to be boundary
+    # verts. Both ends are on the same boundary component, cuts from a hole to the outer boundary don't split the
+    # region.
+    boundary_verts = topology.edge_verts[boundary]
+    vert_boundary = numpy.zeros(topology.verts_len, dtype=bool)
+    vert_boundary[boundary_verts] = True
+    vert_index = numpy.cumsum(vert_boundary) - 1
+    vert_component = numpy.full(topology.verts_len, -1, dtype=numpy.int64)
+    vert_component[vert_boundary] = label_components(vert_index[-1] + 1, vert_index[boundary_verts[:, 0]],
+                                                     vert_index[boundary_verts[:, 1]])
+    cut_invalid = numpy.zeros(edges.size, dtype=bool)
+    cut_continued = numpy.zeros(edges.size, dtype=numpy.int64)
+    cut_outer_left = numpy.zeros(edges.size, dtype=numpy.int64)
+    end_verts, end_cuts = [], []
+    for side in (0, 1):
+        ends = numpy.flatnonzero(next_index[:, side] < 0)
+        verts = topology.edge_verts[edges[ends], side]
+        continued_edges = next_edges[ends, side]
+        inner_face = faces_in_to_boundary_loop__inner_faces(topology, selected, edges[ends], continued_edges, verts)
+        is_continued = (continued_edges >= 0) & boundary[continued_edges] & loop_edges[continued_edges] & \
+                       ((inner_face == left_face[ends]) | (inner_face == right_face[ends]))
+        cut_invalid[cuts[ends[~is_continued & ~vert_boundary[verts]]]] = True
+        continued = ends[is_continued]
+        numpy.add.at(cut_continued, cuts[continued], 1)
+        numpy.add.at(cut_outer_left, cuts[continued], numpy.where(inner_face[is_continued] == right_face[continued],
+                                                                  1, -1))
+        end_verts.append(verts)
+        end_cuts.append(cuts[ends])
+    end_verts, end_cuts = numpy.concatenate(end_verts), numpy.concatenate(end_cuts)
+    end_components = vert_component[end_verts]
+    cut_component = numpy.full(edges.size, -1, dtype=numpy.int64)
+    cut_component[end_cuts] = end_components
+    is_cut = ~cut_invalid & (cut_continued > 0) & (numpy.abs(cut_outer_left) == cut_continued)
+    is_cut[cuts[~is_oriented]] = False
+    is_cut[end_cuts[cut_component[end_cuts] != end_components]] = False
+    cut_ids = numpy.flatnonzero(is_cut)
+    if not cut_ids.size:
+        return cut_ids
+
+    # Shorter cuts first, then the ones going on as boundary at both ends
+    cut_length = numpy.bincount(cuts, minlength=edges.size)
+    cut_rank = numpy.zeros(edges.size, dtype=numpy.int64)
+    cut_rank[cut_ids[numpy.lexsort((cut_ids, -cut_continued[cut_ids], cut_length[cut_ids]))]] = \
+        numpy.arange(cut_ids.size)
+    end_verts, end_cuts = end_verts[is_cut[end_cuts]], end_cuts[is_cut[end_cuts]]
+    vert_rank = numpy.full(topology.verts_len, cut_ids.size, dtype=numpy.int64)
+    numpy.minimum.at(vert_rank, end_verts, cut_rank[end_cuts])
+    is_cut[end_cuts[vert_rank[end_verts] != cut_rank[end_cuts]]] = False
+    cut_edges = numpy.flatnonzero(is_cut[cuts])
+
+    edge_cuts = cuts[cut_edges]
+    is_outer_left = cut_outer_left[edge_cuts] > 0
+    outer_faces = numpy.where(is_outer_left, left_face[cut_edges], right_face[cut_edges])
+    inner_faces = numpy.where(is_outer_left, right_face[cut_edges], left_face[cut_edges])
+    barrier = boundary.copy()
+    barrier[edges[cut_edges]] = True
+
+    # Walk from the outer faces up to the boundary and the cuts, walks meeting each other form one cell
+    face_walk = numpy.full(topology.faces_len, -1, dtype=numpy.int64)
+    face_walk[outer_faces] = 0
+    seeds = numpy.flatnonzero(face_walk == 0)
+    face_walk[seeds] = numpy.arange(seeds.size)
+    face_first = numpy.empty(topology.faces_len, dtype=numpy.int64)
+    met_a, met_b = [], []
+    frontier = seeds
+    while frontier.size:
+        loops = topology.faces_loops(frontier)
+        loops = loops[~barrier[topology.loop_edge[loops]]]
+        walk = face_walk[topology.loop_face[loops]]
+        faces = topology.loop_face[topology.loop_radial_next[loops]]
+        visited = face_walk[faces] >= 0
+        met_a.append(walk[visited])
+        met_b.append(face_walk[faces[visited]])
+        faces, walk = faces[~visited], walk[~visited]
+        face_walk[faces] = walk
+        met_a.append(walk)
+        met_b.append(face_walk[faces])
+        face_first[faces] = numpy.arange(faces.size)
+        frontier = faces[face_first[faces] == numpy.arange(faces.size)]
+    cells = label_components(seeds.size, numpy.concatenate(met_a), numpy.concatenate(met_b))
+
+    # Cells reaching the inner side of their own cut go around it and are kept, the others are peeled at once with
+    # the protrusions hanging off them
+    outer_cells = cells[face_walk[outer_faces]]
+    inner_walk = face_walk[inner_faces]
+    is_around = (inner_walk >= 0) & (cells[numpy.maximum(inner_walk, 0)] == outer_cells)
+    is_outside = numpy.ones(seeds.size, dtype=bool)
+    is_outside[outer_cells[is_around]] = False
+
+    walked = numpy.flatnonzero(face_walk >= 0)
+    return walked[is_outside[cells[face_walk[walked]]]]
+
+
+def faces_in_to_boundary_loop__inner_faces(topology, selected, cut_edges, boundary_edges, verts):
+    # Faces of the cut edges next to the selected face of the boundary edges continuing them at verts, the two faces
+    # share the other edge of the boundary face at the vert
+    loops = topology.edges_link_loops(numpy.maximum(boundary_edges, 0))
+    owner = numpy.repeat(numpy.arange(boundary_edges.size), topology.edge_faces_len[numpy.maximum(boundary_edges, 0)])
+    is_selected = selected[topology.loop_face[loops]]
+    boundary_loop = numpy.full(boundary_edges.size, -1, dtype=numpy.int64)
+    boundary_loop[owner[is_selected]] = loops[is_selected]
+    has_loop = (boundary_edges >= 0) & (boundary_loop >= 0)
+    boundary_loop = numpy.maximum(boundary_loop, 0)
+
+    side_loop = numpy.where(topology.loop_vert[boundary_loop] == verts, topology.loop_prev[boundary_loop],
+                            topology.loop_next[boundary_loop])
+    return numpy.where(has_loop, topology.loop_face[topology.loop_radial_next[side_loop]], -1)
+
+
+def select_faces_out_boundary_loop(bm, topology, face_select, boundary_edges, loop_edges):
+    selected = face_select.copy()
+    boundary = boundary_edges.copy()
+    frontier = numpy.flatnonzero(boundary)
+    while frontier.size:
+        faces = numpy.unique(topology.loop_face[topology.edges_link_loops(frontier)])
+        faces = faces[~selected[faces]]
+        frontier = faces_out_to_boundary_loop__iter_loops(topology, faces, selected, boundary, loop_edges)
+
+    faces_select_set(bm, numpy.flatnonzero(selected & ~face_select), True)
+
+
+def faces_out_to_boundary_loop__iter_loops(topology, faces, selected, boundary, loop_edges):
+    loops = topology.faces_loops(faces)
+    loop_next = topology.loop_next[loops]
+    loop_opposite = topology.loop_next[loop_next]
+    extend = boundary[topology.loop_edge[loops]] & (boundary[topology.loop_edge[loop_next]] |
+                                                    loop_edges[topology.loop_edge[loop_opposite]])
+    extended_faces = numpy.unique(topology.loop_face[loops[extend]])
+    selected[extended_faces] = True
+
+    edges = numpy.unique(topology.loop_edge[topology.faces_loops(extended_faces)])
+    edges = edges[~boundary[edges]]
+    boundary[edges] = True
+    return edges
+
+
+def get_region_to_loop_edges(topology, face_select):
+    # Same rule as region_to_loop: edges between selected and not selected faces, or of a single selected face
+    edge_selected_faces = numpy.bincount(topology.loop_edge[face_select[topology.loop_face]],
+                                         minlength=topology.edges_len)
+    return (edge_selected_faces > 0) & ((edge_selected_faces < topology.edge_faces_len) |
+                                        (topology.edge_faces_len == 1))
+
+
+def get_loop_edges(topology, edges, edge_hide=None):
+    if edge_hide is None or not edge_hide.any():
+        return topology.edges_loops_mask(edges)
+
+    # Hidden edges break the loops, the loop links between visible edges are labelled into runs instead
+    link_edges, link_sides = numpy.nonzero(topology.edge_vert_next >= 0)
+    next_edges = topology.edge_vert_next[link_edges, link_sides]
+    visible = ~edge_hide[link_edges] & ~edge_hide[next_edges]
+    runs = label_components(topology.edges_len, link_edges[visible], next_edges[visible])
+    runs_mask = numpy.zeros(topology.edges_len, dtype=bool)
+    runs_mask[runs[edges]] = True
+    return runs_mask[runs]
+
+
+def faces_select_set(bm, face_indices, value):
+    faces = bm.faces
+    for i in face_indices.tolist():
+        faces[i].select_set(value)
+
+
+def edges_select_set(bm, edge_indices, value):
+    edges = bm.edges
+    for i in edge_indices.tolist():
+        edges[i].select_set(value)
+
+
+def faces_deselect(bm, topology, face_select, dropped):
+    if not dropped.any():
+        return
+
+    # Deselecting faces also deselects verts shared with the kept faces, reselect those faces
+    dropped_verts = numpy.zeros(topology.verts_len, dtype=bool)
+    dropped_verts[topology.loop_vert[topology.faces_loops(numpy.flatnonzero(dropped))]] = True
+    kept = face_select & ~dropped
+    touching_loops = dropped_verts[topology.loop_vert] & kept[topology.loop_face]
 
+    faces_select_set(bm, numpy.flatnonzero(dropped), False)
+    faces_select_set(bm, numpy.unique(topology.loop_face[touching_loops]), True)
 
-def select_faces_out_boundary_loop(bm, selected_faces, boundary_edges, loop_edges):
-    extra_edges = []
 
-    for f in selected_faces:
-        f.select_set(True)
+def edges_deselect(bm, topology, edge_select, dropped):
+    if not dropped.any():
+        return
 
-    for e in boundary_edges:
-        for f in e.link_faces:
-            if f.select:
-                continue
-            faces_out_to_boundary_loop__iter_loops(f, extra_edges, boundary_edges, loop_edges)
+    # Same as faces_deselect, for edges sharing a vert with the dropped ones
+    dropped_verts = numpy.zeros(topology.verts_len, dtype=bool)
+    dropped_verts[topology.edge_verts[dropped]] = True
+    kept = edge_select & ~dropped
+    touching = kept & dropped_verts[topology.edge_verts].any(axis=1)
 
-    while extra_edges:
-        e = extra_edges.pop()
-        for f in e.link_faces:
-            if f.select:
-                continue
-            faces_out_to_boundary_loop__iter_loops(f, extra_edges, boundary_edges, loop_edges)
+    edges_select_set(bm, numpy.flatnonzero(dropped), False)
+    edges_select_set(bm, numpy.flatnonzero(touching), True)
+
+
+#
+# Selection masks functions
+#
+
+select_mode_elements = (("VERT", "vertices", "verts"), ("EDGE", "edges", "edges"), ("FACE", "polygons", "faces"))
+
+
+def get_selection_masks(obj):
+    # Vert, edge and face selection of the edit mesh
+    obj.update_from_editmode()
+    return [foreach_get_array(getattr(obj.data, attr), "select", bool) for _mode, attr, _seq in select_mode_elements]
 
 
-def faces_out_to_boundary_loop__iter_loops(f, extra_edges, boundary_edges, loop_edges):
-    for l in f.loops:
-        if l.edge not in boundary_edges:
+def set_selection_masks(bm, masks, current_masks, select_mode):
+    # Only elements of the select mode which differ from the current selection are written
+    for (mode, _attr, seq_name), mask, current in zip(select_mode_elements, masks, current_masks):
+        if mode not in select_mode:
             continue
-        if l.link_loop_next.edge in boundary_edges or l.link_loop_next.link_loop_next.edge in loop_edges:
-            f.select_set(True)
-            for e in f.edges:
-                if e not in boundary_edges:
-                    boundary_edges.append(e)
-                    extra_edges.append(e)
+        seq = getattr(bm, seq_name)
+        seq.ensure_lookup_table()
+        for i in numpy.flatnonzero(mask != current).tolist():
+            seq[i].select = bool(mask[i])
 
 
-def get_region_to_loop_edges(bms):
-    bpy.ops.mesh.region_to_loop('EXEC_DEFAULT')
-    return [[e for e in bm.edges if e.select] for bm in bms]
+def pattern_buffer_sample(pattern_buffer, points_2d, center, radius):
+    # Pattern pixels under (N, 2) region points, the pattern spans the brush box and is indexed by [x][y]. Points
+    # outside of the box get the border pixels.
+    resolution = len(pattern_buffer)
+    pixels = (points_2d - (center[0] - radius, center[1] - radius)) * (resolution / (radius * 2))
+    pixels = numpy.clip(numpy.floor(pixels), 0, resolution - 1).astype(numpy.int64)
+    return pattern_buffer[pixels[:, 0], pixels[:, 1]]
 
 
-def get_loop_edges(bms):
-    bpy.ops.mesh.loop_multi_select('EXEC_DEFAULT')
-    return [[e for e in bm.edges if e.select] for bm in bms]
+def pattern_coverage(pattern_sat, points_min, points_max, center, radius):
+    # Part of the pattern pixels set in the pixel boxes spanning [points_min, points_max], from the summed-area table
+    resolution = len(pattern_sat) - 1
+    origin = (center[0] - radius, center[1] - radius)
+    scale = resolution / (radius * 2)
+    p0 = numpy.clip(numpy.floor((points_min - origin) * scale), 0, resolution - 1).astype(numpy.int64)
+    p1 = numpy.clip(numpy.floor((points_max - origin) * scale), 0, resolution - 1).astype(numpy.int64) + 1
+    (x0, y0), (x1, y1) = p0.T, p1.T
+    pixels_set = pattern_sat[x1, y1] - pattern_sat[x0, y1] - pattern_sat[x1, y0] + pattern_sat[x0, y0]
+    return pixels_set / ((x1 - x0) * (y1 - y0))
+
+
+def selection_combine(func, *selections):
+    return {obj: [func(*masks) for masks in zip(*(selection[obj] for selection in selections))]
+            for obj in selections[0]}
 
 
 #
@@ -139,6 +387,10 @@ def perfect_select_invoke(context, event, operator):
         operator.draw_handle = bpy.types.SpaceView3D.draw_handler_add(perfect_select_draw_callback,
                                                                       handler_args,
                                                                       'WINDOW', 'POST_PIXEL')
+        operator.timer = wm.event_timer_add(Helper.get_frame_time_budget(context), window=context.window)
+        operator._event_pending = False
+        operator._event_deferred_until = 0.0
+        freeze_objects_geometry_version()
         wm.modal_handler_add(operator)
 
     return {'RUNNING_MODAL'}
@@ -153,9 +405,6 @@ def perfect_select_execute(context, operator):
 
 
 def perfect_select_modal(context, event, operator):
-    context.area.tag_redraw()
-    tool_settings = Helper.get_tool_settings(context)
-
     if not operator.wait_for_input and event.type in ['LEFT_SHIFT', 'LEFT_CTRL']:
         if event.value == 'PRESS':
             operator._extend_to_loop = event.shift
@@ -163,22 +412,35 @@ def perfect_select_modal(context, event, operator):
             operator._extend_to_loop = None
 
     if event.type in {'RIGHTMOUSE', 'ESC'}:
-        bpy.types.SpaceView3D.draw_handler_remove(operator.draw_handle, 'WINDOW')
-        tool_settings.show_select_cursor = True
-        operator.clean_status_text(context)
+        perfect_select_cancel(context, operator)
         return {'CANCELLED'}
 
+    # Events are only recorded here, queued moves and radius changes are applied together on the next timer tick. The
+    # brush is redrawn at once, also when the selection update is deferred.
     if event.type in ['MOUSEMOVE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE', 'LEFT_SHIFT', 'LEFT_CTRL']:
         operator.x, operator.y = Helper.get_mouse_region_pos(event)
-    #     if (self.wait_for_input and self._select_enabled) or not self.wait_for_input:
-    #         self.execute(context)
-    #
+        operator._event_pending = True
+        context.area.tag_redraw()
+
     if event.type in ('WHEELUPMOUSE', 'WHEELDOWNMOUSE') and not event.ctrl:
         if event.type == 'WHEELDOWNMOUSE':
             operator.radius += int(2 + operator.radius / 10)
         else:
             operator.radius -= int(2 + operator.radius / 10)
     #     return {'RUNNING_MODAL'}
+
+    if event.type == 'TIMER' and operator._event_pending:
+        time_start = time.perf_counter()
+        if time_start >= operator._event_deferred_until:
+            operator._event_pending = False
+            if (operator.wait_for_input and operator._select_enabled) or not operator.wait_for_input:
+                operator.execute(context)
+            context.area.tag_redraw()
+
+            # Selection slower than the budget skips the following ticks for the time it went over
+            time_end = time.perf_counter()
+            time_over = time_end - time_start - Helper.get_frame_time_budget(context)
+            operator._event_deferred_until = time_end + max(time_over, 0.0)
     #
     # if event.type == 'LEFTMOUSE' and event.value == 'PRESS':
     #     self._select_enabled = True
@@ -199,7 +461,7 @@ def perfect_select_modal(context, event, operator):
     #     self.mode = "ADD"
     #     bpy.types.SpaceView3D.draw_handler_remove(self._draw_handle, 'WINDOW')
     #     ps_tool_settings.show_select_cursor = True
-    #     self._clean_tags(context)
+    #     self._clean_persistent_selection()
     #     return {'FINISHED'}
     #
     # if event.type == 'LEFTMOUSE' and event.shift and event.value == 'RELEASE':
@@ -213,12 +475,23 @@ def perfect_select_modal(context, event, operator):
     #     bpy.types.SpaceView3D.draw_handler_remove(self._draw_handle, 'WINDOW')
     #     self.wait_for_input = True
     #     ps_tool_settings.show_select_cursor = True
-    #     self._clean_tags(context)
+    #     self._clean_persistent_selection()
     #     return {'FINISHED'}
 
     return {'RUNNING_MODAL'}
 
 
+def perfect_select_cancel(context, operator):
+    # Every exit of the modal goes through here, also when Blender cancels it on its own
+    bpy.types.SpaceView3D.draw_handler_remove(operator.draw_handle, 'WINDOW')
+    context.window_manager.event_timer_remove(operator.timer)
+    freeze_objects_geometry_version(False)
+    if context.area is not None:
+        context.area.tag_redraw()
+    Helper.get_tool_settings(context).show_select_cursor = True
+    operator.clean_status_text(context)
+
+
 def cpp_perfect_select(context, operator):
     backend_module = get_backend_module()
     if not backend_module:
@@ -266,6 +539,10 @@ class Helper:
     def get_tool_settings(cls, context):
         return context.scene.perfect_select_tool_settings
 
+    @classmethod
+    def get_frame_time_budget(cls, context):
+        return context.preferences.addons["perfect_select"].preferences.frame_time_budget / 1000
+
     @classmethod
     def get_status_text(cls, operator):
         elements = [("WhDown/Pad+", "Add"),
@@ -278,8 +555,7 @@ class Helper:
             elements = release_elements + elements + input_elements
         else:
             extend_elements = [("Shift⇧", "Extend to Widest Boundary Loops"),
-                               # ("Ctrl", "Reduce to Narrowest Boundary Loops")
-                               ]
+                               ("Ctrl", "Reduce to Narrowest Boundary Loops")]
             elements.extend(extend_elements)
 
         return "        ".join("[{}] {}".format(*e) for e in elements)
@@ -300,8 +576,8 @@ class Helper:
                                       wait_for_input=False, mode=mode)
 
     def extend_operator(self):
-        if self._extend_to_loop:
-            bpy.ops.perfect_select.extend_to_edge_loops('EXEC_DEFAULT')
+        if self._extend_to_loop is not None:
+            bpy.ops.perfect_select.extend_to_edge_loops('EXEC_DEFAULT', inner=not self._extend_to_loop)
 
     def _get_select_args(self, context):
         ps_tool_settings = self._get_tool_settings(context)
@@ -311,31 +587,33 @@ class Helper:
         snap_backface_culling = context.tool_settings.use_snap_backface_culling
         return context, use_snap, snap_elements, snap_edge_slide, snap_backface_culling
 
-    def _init_loop(self, region, rv3d, mtx, mtx_sr, backface_culling=False):
-        bpy.ops.mesh.select_all(action='DESELECT')
-        self._snap_edge.select = True
-        bpy.ops.mesh.loop_multi_select()
-
-        eye = Vector(rv3d.view_matrix[2][:3])
-        if not rv3d.is_perspective:
-            eye.length = 10000  # change to clip_end
-        else:
-            eye.length = rv3d.view_distance
-        eye_location = rv3d.view_location + eye
-
+    def _init_loop(self, obj, topology, projection, rv3d, mtx_sr, backface_culling=False):
+        # Edge slide loop as edge indices with their world and region segments, gathered once per loop
+        loop = topology.edge_loop(self._snap_edge.index)
+        verts_co, verts_2d, verts_valid = projection.get_object_verts(obj)
         if backface_culling:
-            self._loop = [e for e in self._get_bms_selected_edges() if not is_backface(e.verts[0], eye_location, mtx, mtx_sr)]
-        else:
-            self._loop = [e for e in self._get_bms_selected_edges()]
-        self._loop_2d = points_pairs_3d_to_region_2d(((mtx @ e.verts[0].co, mtx @ e.verts[1].co) for e in self._loop),
-                                                     region, rv3d)
+            loop = loop[self._get_facing_verts_mask(obj, projection, topology.edge_verts[loop, 0], mtx_sr, rv3d)]
+        loop = loop[verts_valid[topology.edge_verts[loop]].all(axis=1)]
+        self._loop = loop
+        self._loop_co = verts_co[topology.edge_verts[loop]]
+        self._loop_2d = verts_2d[topology.edge_verts[loop]]
+        self._loop_mask = numpy.zeros(topology.edges_len, dtype=bool)
+        self._loop_mask[loop] = True
+
+    @staticmethod
+    def _get_facing_verts_mask(obj, projection, verts, mtx_sr, rv3d):
+        verts_co, _verts_2d, _verts_valid = projection.get_object_verts(obj)
+        return backface_culling_mask(verts_co[verts], projection.get_object_normals(obj)[verts],
+                                     get_eye_location(rv3d), mtx_sr=mtx_sr)
 
     def _del_loop(self):
         self._loop = None
+        self._loop_co = None
         self._loop_2d = None
+        self._loop_mask = None
 
     def _filter_loop_edges(self, edges):
-        return (e for e in edges if e in self._loop)
+        return edges[self._loop_mask[edges]]
 
     def _get_bms_selected_verts(self, return_co_list=False):
         if not return_co_list:
@@ -379,8 +657,8 @@ class Helper:
         select_mode = self._bms[context.object].select_mode
         return (g for bm in self._bms.values() for g in chain(_get_seqs(bm)))
 
-    def _snap(self, co, pos, vert, vert_co, mtx, mtx_sr, selection_normal, view_location, snap_elements, snap_edge_slide,
-              snap_backface_culling, region, rv3d):
+    def _snap(self, co, pos, obj, vert, vert_co, bm, topology, projection, mtx, mtx_sr, selection_normal,
+              view_location, snap_elements, snap_edge_slide, snap_backface_culling, rv3d):
         pos_2d = Vector(pos[:2])
         points = []
         if "VERTEX" in snap_elements:
@@ -388,61 +666,167 @@ class Helper:
             selection_normal = vert.normal
             view_location = vert_co
         if any(e in snap_elements for e in ("EDGE", "EDGE_MIDPOINT", "EDGE_PERPENDICULAR")):
-            edges = vert.link_edges
+            edges = topology.vert_link_edges(vert.index)
             if snap_edge_slide and self._snap_edge:
                 if self._loop is None:
-                    self._init_loop(region, rv3d, mtx, mtx_sr, snap_backface_culling)
-
-                edges_co = [(mtx @ e.verts[0].co, mtx @ e.verts[1].co) for e in self._filter_loop_edges(edges)]
-                if not edges_co:
-                    edges = self._loop
-                    edges_co_2d = self._loop_2d
-                else:
-                    edges_co_2d = points_pairs_3d_to_region_2d(edges_co, region, rv3d)
-            else:
-                edges_co = [(mtx @ e.verts[0].co, mtx @ e.verts[1].co) for e in vert.link_edges]
-                edges_co_2d = points_pairs_3d_to_region_2d(edges_co, region, rv3d)
-
-            if edges_co_2d:
-                closest_points = [(i, e, intersect_point_section_2d(pos_2d, e[0], e[1])[0]) for i, e in
-                                  enumerate(edges_co_2d)]
-                closest_points.sort(key=lambda i: (i[2] - pos_2d).length)
-                closest_index, closest_edge_co, closest_point = closest_points[0]
-                closest_edge = edges[closest_index]
+                    self._init_loop(obj, topology, projection, rv3d, mtx_sr, snap_backface_culling)
+
+                edges = self._filter_loop_edges(edges)
+
+            verts_co, verts_2d, verts_valid = projection.get_object_verts(obj)
+            if snap_backface_culling:
+                edges = edges[self._get_facing_verts_mask(obj, projection, topology.edge_verts[edges, 0], mtx_sr, rv3d)]
+            edges = edges[verts_valid[topology.edge_verts[edges]].all(axis=1)]
+            edges_co = verts_co[topology.edge_verts[edges]]
+            edges_co_2d = verts_2d[topology.edge_verts[edges]]
+            if not edges.size and snap_edge_slide and self._snap_edge:
+                edges, edges_co, edges_co_2d = self._loop, self._loop_co, self._loop_2d
+
+            if edges.size:
+                closest, _factor, midpoints, endpoints = closest_points_on_sections_2d(pos_2d, edges_co_2d)
+                closest_index = int(numpy.argmin(((closest - pos_2d) ** 2).sum(axis=1)))
+                closest_edge = bm.edges[edges[closest_index]]
+                p0, p1 = map(Vector, edges_co[closest_index])
                 if snap_edge_slide:
                     self._snap_edge = closest_edge
-                    self._snap_edge_co = (mtx @ closest_edge.verts[0].co, mtx @ closest_edge.verts[1].co)
+                    self._snap_edge_co = (p0, p1)
 
                 selection_normal = (mtx_sr @ closest_edge.verts[0].normal + mtx_sr @ closest_edge.verts[1].normal) / 2
-                view_location = (mtx @ closest_edge.verts[0].co + mtx @ closest_edge.verts[1].co) / 2
+                view_location = (p0 + p1) / 2
                 if "EDGE" in snap_elements:
-                    points.append(closest_point)
+                    points.append(Vector(closest[closest_index]))
                 if "EDGE_MIDPOINT" in snap_elements:
-                    closest_edge_co = edges_co_2d[closest_index]
-                    points.append(closest_edge_co[0].lerp(closest_edge_co[1], 0.5))
+                    points.append(Vector(midpoints[closest_index]))
                 if "EDGE_PERPENDICULAR" in snap_elements:
-                    points.append(closest_edge_co[0] if (closest_edge_co[0] - pos_2d).length < (
-                            closest_edge_co[1] - pos_2d).length else closest_edge_co[1])
+                    points.append(Vector(endpoints[closest_index]))
 
         if points:
-            points.sort(key=lambda v: (Vector(v) - pos_2d).length)
-            co = points[0]
+            co = min(points, key=lambda v: (v - pos_2d).length)
             self._snap_point = co
 
         return co, selection_normal, view_location
 
-    def _mirror(self, context):
-        mirror_axis = set()
-        if context.object.data.use_mirror_x:
-            mirror_axis.update("X")
-        if context.object.data.use_mirror_y:
-            mirror_axis.update("Y")
-        if context.object.data.use_mirror_z:
-            mirror_axis.update("Z")
-        if mirror_axis:
-            for bm in self._bms.values():
-                bm.select_mode = {"VERT", "FACE", "EDGE"}
-            bpy.ops.mesh.select_mirror(axis=mirror_axis, extend=True)
+    def _snap_face(self, pos, region, rv3d, snap_backface_culling):
+        # Nearest surface hit under the cursor, ray cast against the cached trees in object space
+        origin, direction = region_2d_to_ray_3d(pos[:2], region, rv3d)
+        closest = None
+        for obj, bvh in get_snap_bvhs():
+            mtx = obj.matrix_world
+            mtx_inv = mtx.inverted()
+            location, normal, _index, _distance = bvh.ray_cast(mtx_inv @ origin, mtx_inv.to_3x3() @ direction)
+            if location is None:
+                continue
+
+            mtx_t, mtx_s, mtx_r = matrix_decompose_4x4(mtx)
+            location = mtx @ location
+            normal = mtx_s @ mtx_r @ normal
+            distance = (location - origin).length
+            if snap_backface_culling and normal.dot(direction) >= 0.0:
+                continue
+            if closest is None or distance < closest[0]:
+                closest = (distance, location, normal)
+
+        if closest is None:
+            return None
+        _distance, location, normal = closest
+        co_2d, valid = points_3d_to_region_2d(location, region, rv3d.perspective_matrix)
+        if not valid[0]:
+            return None
+        return Vector((*co_2d[0], 0.0)), normal, location
+
+    def _get_brush_normal(self, projection, co, rv3d):
+        # Area weighted normal of the verts under the brush facing the view, steady on noisy meshes
+        brush_verts, _distances_squared = projection.find_range_indices(co, self.radius)
+        eye_location = get_eye_location(rv3d)
+        normal = Vector((0.0, 0.0, 0.0))
+        for obj, bm, verts in projection.split_indices(brush_verts):
+            mtx_t, mtx_s, mtx_r = matrix_decompose_4x4(obj.matrix_world)
+            mtx_sr = mtx_s @ mtx_r
+            normals = get_mesh_normals(obj, bm)
+            verts_co, _verts_2d, _verts_valid = projection.get_object_verts(obj)
+            verts = verts[backface_culling_mask(verts_co[verts], normals.vert_normal_area[verts], eye_location,
+                                                mtx_sr=mtx_sr)]
+            normal += mtx_sr @ Vector(normals.verts_normal(verts))
+        return normal.normalized() if normal.length > 0.0 else None
+
+    @staticmethod
+    def _use_xray(context):
+        shading = context.space_data.shading
+        return shading.show_xray_wireframe if shading.type == 'WIREFRAME' else shading.show_xray
+
+    def _select_aligned(self, context, region, perspective_matrix, center, eye_location):
+        # Verts inside the brush of the aligned view. Without x-ray only verts facing it are selected.
+        use_xray = self._use_xray(context)
+        use_circle = self.wait_for_input or self._get_tool_settings(context).pattern_source == "CIRCLE"
+        for obj, bm in self._bms.items():
+            obj.update_from_editmode()
+            verts_co = foreach_get_array(obj.data.vertices, "co", numpy.float32, 3)
+            mtx = numpy.array(obj.matrix_world, dtype=numpy.float64)
+            verts_co = verts_co @ mtx[:3, :3].T + mtx[:3, 3]
+            points_2d, inside = points_3d_to_region_2d(verts_co, region, perspective_matrix)
+            inside &= ~foreach_get_array(obj.data.vertices, "hide", bool)
+
+            offsets = numpy.abs(points_2d - center)
+            if use_circle:
+                inside &= numpy.hypot(offsets[:, 0], offsets[:, 1]) <= self.radius
+            else:
+                inside &= (offsets <= self.radius).all(axis=1)
+            verts = numpy.flatnonzero(inside)
+            if not use_xray:
+                mtx_t, mtx_s, mtx_r = matrix_decompose_4x4(obj.matrix_world)
+                verts_normal = foreach_get_array(obj.data.vertices, "normal", numpy.float32, 3)
+                verts = verts[backface_culling_mask(verts_co[verts], verts_normal[verts], eye_location,
+                                                    mtx_sr=mtx_s @ mtx_r)]
+
+            bm.verts.ensure_lookup_table()
+            for i in verts.tolist():
+                bm.verts[i].select = True
+        self._select_flush()
+
+    def _select_swept(self, co):
+        # Brush stamps between the previous event and this one at most a radius apart, so fast strokes leave no gaps.
+        # The select operator keeps its occlusion test without x-ray and the select mode of the meshes.
+        (x, y), radius = self._stroke
+        spacing = max(min(radius, self.radius), 1)
+        steps = int(numpy.ceil(numpy.hypot(co[0] - x, co[1] - y) / spacing))
+        for step in range(1, steps):
+            factor = step / steps
+            self.select_operator(round(x + (co[0] - x) * factor), round(y + (co[1] - y) * factor),
+                                 radius=round(radius + (self.radius - radius) * factor), mode="ADD")
+
+    def _mirror(self, selection):
+        # Selected verts are mirrored through cached vert maps, for the operator mirror axes and the mesh ones. The
+        # selection masks read for the event are updated as the flush does, instead of being read again.
+        mirrored_any = False
+        for obj, bm in self._bms.items():
+            mesh = obj.data
+            axes = [axis for axis, use_mirror in enumerate(zip(self.mirror, (mesh.use_mirror_x, mesh.use_mirror_y,
+                                                                              mesh.use_mirror_z))) if any(use_mirror)]
+            if not axes:
+                continue
+
+            verts_select, edges_select, faces_select = selection[obj]
+            verts_mirrored = verts_select
+            for axis in axes:
+                verts_mirrored = get_mesh_mirror(obj, bm, axis, mesh_synced=True).mirror_verts_mask(verts_mirrored)
+            verts = numpy.flatnonzero(verts_mirrored & ~verts_select)
+            if not verts.size:
+                continue
+
+            bm.verts.ensure_lookup_table()
+            for i in verts.tolist():
+                bm.verts[i].select = True
+            mirrored_any = True
+
+            topology = get_mesh_topology(obj, bm, mesh_synced=True)
+            edges_select = edges_select | (verts_mirrored[topology.edge_verts].all(axis=1) &
+                                           ~foreach_get_array(mesh.edges, "hide", bool))
+            if topology.faces_len:
+                faces_select = faces_select | (numpy.logical_and.reduceat(verts_mirrored[topology.loop_vert],
+                                                                          topology.face_loop_start) &
+                                               ~foreach_get_array(mesh.polygons, "hide", bool))
+            selection[obj] = [verts_mirrored, edges_select, faces_select]
+        if mirrored_any:
             self._select_flush()
 
     def _select_flush(self, value=True):
@@ -452,50 +836,73 @@ class Helper:
             bm.select_flush(value)
 
     def select(self, context, use_snap, snap_elements, snap_edge_slide, snap_backface_culling):
-        def _set_original_selection(geom, force=False):
-            if self._geom_selected_original is not None and not force:
-                for _element in self._geom_selected_original:
-                    if not _element.is_valid:
-                        self._geom_selected_original = None
-                        break
-
-            if self._geom_selected_original is None or force:
-                self._geom_selected_original = geom
-
-        def _add_persistent_selection(geom):
-            for geom_element in geom:
-                geom_element.tag = True
-
-        def _select(geom, value):
-            for element in geom:
-                element.select = value
+        def _set_original_selection(selection, force=False):
+            if self._selection_original is None or force:
+                self._selection_original = selection
 
-        def _select_original(value=True):
-            _select(self._geom_selected_original, value)
-
-        def _select_persistent(value=True):
-            geom = (g for g in self._get_bms_geom_iter(context) if g.tag)
-            _select(geom, value)
+        def _add_persistent_selection(selection):
+            if self._selection_persistent is None:
+                self._selection_persistent = selection
+            else:
+                self._selection_persistent = selection_combine(numpy.logical_or, self._selection_persistent, selection)
 
-        def _pattern_filter():
-            pattern_buffer = self._pattern_buffer
+        def _pattern_filter(center, perspective_matrix=None):
+            pattern_buffer = self._get_pattern_buffer(context)
             if pattern_buffer is None:
                 return
 
+            # Verts sample the pattern pixel under them, edges and faces are kept by the part of their region
+            # bounds covered by the pattern. The view's own projection is reused from the cache, only other
+            # perspectives project the verts again.
             ps_tool_settings = self._get_tool_settings(context)
-            resolution = ps_tool_settings.pattern_resolution - 1
-            _verts, _verts_co = self._get_bms_selected_verts(True)
-
-            radius = self.radius
-            points_2d = points_3d_to_region_2d(_verts_co, region, rv3d)
-
-            for idx, _co in enumerate(points_2d):
-                _w = max(min((_co[0] - (co[0] - radius)) / (radius*2), 1.0), 0.0)
-                _h = max(min((_co[1] - (co[1] - radius)) / (radius*2), 1.0), 0.0)
-                _w = int(resolution * _w)
-                _h = int(resolution * _h)
-                if not pattern_buffer[_w][_h]:
-                    _verts[idx].select = False
+            pattern_sat = get_selection_pattern_sat(ps_tool_settings.pattern_resolution)
+            projection = None
+            if perspective_matrix is None:
+                projection = get_region_projection(region, rv3d, self._bms, self.radius * 1.5)
+            for obj, bm in self._bms.items():
+                verts_select, edges_select, faces_select = get_selection_masks(obj)
+                if projection is not None:
+                    _verts_co, points_2d, points_2d_valid = projection.get_object_verts(obj)
+                else:
+                    verts_co = foreach_get_array(obj.data.vertices, "co", numpy.float32, 3)
+                    mtx = numpy.array(obj.matrix_world, dtype=numpy.float64)
+                    points_2d, points_2d_valid = points_3d_to_region_2d(verts_co @ mtx[:3, :3].T + mtx[:3, 3],
+                                                                        region, perspective_matrix)
+
+                if "VERT" in bm.select_mode:
+                    verts = numpy.flatnonzero(verts_select & points_2d_valid)
+                    keep = pattern_buffer_sample(pattern_buffer, points_2d[verts], center, self.radius)
+
+                    bm.verts.ensure_lookup_table()
+                    for i in verts[~keep].tolist():
+                        bm.verts[i].select = False
+                    continue
+
+                topology = get_mesh_topology(obj, bm, mesh_synced=True)
+                # Bounds of the selected elements only, from the same region coordinates
+                if "EDGE" in bm.select_mode:
+                    edges = numpy.flatnonzero(edges_select)
+                    edges = edges[points_2d_valid[topology.edge_verts[edges]].all(axis=1)]
+                    edges_2d = points_2d[topology.edge_verts[edges]]
+                    coverage = pattern_coverage(pattern_sat, edges_2d.min(axis=1), edges_2d.max(axis=1), center,
+                                                self.radius)
+                    dropped = numpy.zeros(topology.edges_len, dtype=bool)
+                    dropped[edges[coverage < ps_tool_settings.pattern_coverage]] = True
+                    edges_deselect(bm, topology, edges_select, dropped)
+                elif faces_select.any():
+                    faces = numpy.flatnonzero(faces_select)
+                    loops = topology.faces_loops(faces)
+                    faces_loop_total = topology.face_loop_total[faces]
+                    starts = numpy.cumsum(faces_loop_total) - faces_loop_total
+                    loops_2d = points_2d[topology.loop_vert[loops]]
+                    faces_valid = numpy.logical_and.reduceat(points_2d_valid[topology.loop_vert[loops]], starts)
+                    faces_min = numpy.minimum.reduceat(loops_2d, starts)[faces_valid]
+                    faces_max = numpy.maximum.reduceat(loops_2d, starts)[faces_valid]
+                    faces = faces[faces_valid]
+                    coverage = pattern_coverage(pattern_sat, faces_min, faces_max, center, self.radius)
+                    dropped = numpy.zeros(topology.faces_len, dtype=bool)
+                    dropped[faces[coverage < ps_tool_settings.pattern_coverage]] = True
+                    faces_deselect(bm, topology, faces_select, dropped)
             self._select_flush(False)
 
         co = pos = Vector((self.x, self.y, 0.0))
@@ -512,129 +919,167 @@ class Helper:
                 obj.update_from_editmode()
                 self._bms[obj] = bmesh.from_edit_mesh(obj.data)
                 self._bms_select_mode.append(self._bms[obj].select_mode)
+        self._check_mesh_versions()
 
+        if not self._set_continue:
+            self._stroke = None
         if self.mode == "SET" and not self._set_continue:
             bpy.ops.mesh.select_all(action='DESELECT')
 
-        _set_original_selection([g for g in self._get_bms_geom_iter(context) if g.select])
+        if self._selection_original is None:
+            _set_original_selection(self._get_selection())
 
         self.select_operator(mode="SET")
         if use_snap or self.align_to_normal:
+            if use_snap:
+                self._snap_point = None
             snap_edge = self._snap_edge
             snap_edge_co = self._snap_edge_co
 
-            verts_selected, verts_co_selected = self._get_bms_selected_verts(True)
-
-            index = 0
-            restore_values = False
-            if verts_co_selected:
-                verts_co_2d = points_3d_to_region_2d(verts_co_selected, region, rv3d)
-                kd = create_kdtree(verts_co_2d)
-                co, index, dist = kd.find(co)
-                if co is None:
-                    restore_values = True
-            if restore_values:
-                co, index = pos, 0
+            # Nearest vert selected by the brush or just outside of it, the projection is reused until the view
+            # changes. Not selected verts under the brush are occluded.
+            vert = None
+            projection = get_region_projection(region, rv3d, self._bms, self.radius * 1.5)
+            indices, distances_squared = projection.find_range_indices(co, self.radius * 1.5)
+            candidates = projection.get_verts_select(indices) | (distances_squared > self.radius * self.radius)
+            if candidates.any():
+                index = int(indices[candidates][numpy.argmin(distances_squared[candidates])])
+                obj, bm, vert = projection.get_vert(index)
+                co = Vector((*projection.co_2d[index], 0.0))
+            else:
+                co = pos
 
-            vert = verts_selected[index] if verts_selected else None
             if vert is None and snap_edge is not None:
                 points_3d = region_2d_to_points_3d(pos[:2], region, rv3d)
                 len_0 = (snap_edge_co[0] - points_3d).length
                 len_1 = (snap_edge_co[1] - points_3d).length
                 _index = int(len_0 > len_1)
                 vert = snap_edge.verts[_index]
-            if vert is not None:
-                mtx = Matrix()
                 for obj, bm in self._bms.items():
                     if vert in bm.verts:
-                        mtx = obj.matrix_world
                         break
+            if vert is not None:
+                mtx = obj.matrix_world
+                topology = get_mesh_topology(obj, bm)
                 mtx_t, mtx_s, mtx_r = matrix_decompose_4x4(mtx)
                 mtx_sr = mtx_s @ mtx_r
                 vert_co = mtx @ vert.co
                 if use_snap:
-                    co, selection_normal, view_location = self._snap(co, pos, vert, vert_co, mtx, mtx_sr,
+                    co, selection_normal, view_location = self._snap(co, pos, obj, vert, vert_co, bm, topology,
+                                                                     projection, mtx, mtx_sr,
                                                                      selection_normal,
                                                                      view_location,
                                                                      snap_elements, snap_edge_slide,
                                                                      snap_backface_culling,
-                                                                     region, rv3d)
+                                                                     rv3d)
                 else:
                     self._snap_point = None
                     view_location = vert_co
-                    link_faces = vert.link_faces
-                    if link_faces:
-                        n = Vector((0.0, 0.0, 0.0))
-                        for f in link_faces:
-                            n += mtx_sr @ f.normal
-                        selection_normal = n / len(link_faces)
+                    selection_normal = self._get_brush_normal(projection, co, rv3d) or selection_normal
+
+            # Faces are snapped to when there is no vert or edge to snap to
+            if use_snap and self._snap_point is None and any(e in snap_elements for e in ("FACE", "FACE_PROJECT")):
+                snap_face = self._snap_face(pos, region, rv3d, snap_backface_culling)
+                if snap_face is not None:
+                    co, selection_normal, view_location = snap_face
+                    self._snap_point = co
 
         if self._snap_point:
             co = self._snap_point
             self.select_operator(co[0], co[1], mode="SET")
 
         if self.align_to_normal and not self.wait_for_input and selection_normal is not None:
+            # Brush applied at the region center of a view aligned to the normal, evaluated without changing rv3d
             bpy.ops.mesh.select_all(action='DESELECT')
-            old_view_location = rv3d.view_location.copy()
-            rv3d.view_location = view_location
-
-            old_view_rotation = rv3d.view_rotation.copy()
-            view_rotation = selection_normal.rotation_difference(Vector((0, 0, 1)))
-            rv3d.view_rotation = view_rotation.inverted()
-
-            rv3d.update()
-            self.select_operator(context.region.width / 2, context.region.height / 2, mode="SET")
-            _pattern_filter()
-            rv3d.view_location = old_view_location
-            rv3d.view_rotation = old_view_rotation
-            rv3d.update()
+            aligned_perspective_matrix = get_aligned_perspective_matrix(rv3d, view_location, selection_normal)
+            aligned_center = (region.width / 2, region.height / 2)
+            eye = selection_normal.normalized()
+            eye.length = rv3d.view_distance if rv3d.is_perspective else 10000  # change to clip_end
+            self._select_aligned(context, region, aligned_perspective_matrix, aligned_center, view_location + eye)
+            _pattern_filter(aligned_center, aligned_perspective_matrix)
         else:
-            _pattern_filter()
+            _pattern_filter(co)
+            if self._stroke is not None and self._get_pattern_buffer(context) is None:
+                self._select_swept(co)
 
-        self._mirror(context)
+        self._stroke = ((co[0], co[1]), self.radius)
 
-        if self.use_preselect and not self.wait_for_input:
-            self._clean_tags(context)
-
-        _add_persistent_selection(g for g in self._get_bms_geom_iter(context) if g.select)
+        # Masks are read once for the event, the tool's own changes after this point are applied to them as well
+        selection = self._get_selection()
+        self._mirror(selection)
 
-        if self.mode == "ADD":
-            _select_persistent(True)
+        if self.use_preselect and not self.wait_for_input:
+            self._clean_persistent_selection()
+        _add_persistent_selection(selection)
+
+        if self.mode == "ADD" and self._extend_to_loop is None:
+            self._set_selection(selection_combine(lambda s, p, o: s | p | o, selection, self._selection_persistent,
+                                                  self._selection_original), selection)
+        elif self.mode == "ADD":
+            self._set_selection(selection_combine(numpy.logical_or, selection, self._selection_persistent), selection)
             self.extend_operator()
-            _select_original()
+            selection = self._get_selection()
+            self._set_selection(selection_combine(numpy.logical_or, selection, self._selection_original), selection)
         elif self.mode == "SUB":
-            sub_extra_selection = []
-            if self._extend_to_loop:
-                _select_persistent(True)
+            if self._extend_to_loop is not None:
+                self._set_selection(selection_combine(numpy.logical_or, selection, self._selection_persistent),
+                                    selection)
                 self.extend_operator()
-                sub_extra_selection = [g for g in self._get_bms_geom_iter(context) if g.select]
-                _select_original()
+                sub_extra_selection = self._get_selection()
+                self._set_selection(selection_combine(lambda o, e: o & ~e, self._selection_original,
+                                                      sub_extra_selection), sub_extra_selection)
             else:
-                _select_original()
-                _select_persistent(False)
-            if sub_extra_selection:
-                _select(sub_extra_selection, False)
+                self._set_selection(selection_combine(lambda s, o, p: (s | o) & ~p, selection,
+                                                      self._selection_original, self._selection_persistent),
+                                    selection)
         else:
-            _select_persistent(True)
+            self._set_selection(selection_combine(numpy.logical_or, selection, self._selection_persistent), selection)
             self.extend_operator()
 
         self._select_flush()
         self._set_continue = True
 
         if self.wait_for_input:
-            _set_original_selection([g for g in self._get_bms_geom_iter(context) if g.select], True)
-            self._clean_tags(context)
+            _set_original_selection(self._get_selection(), True)
+            self._clean_persistent_selection()
 
     def _clean(self):
         self._del_loop()
+        self._stroke = None
         self._snap_point = None
         self._snap_edge = None
         self._snap_edge_co = None
 
-    def clean_tags(self, context):
-        tagged_geom = (g for g in self._get_bms_geom_iter(context) if g.tag)
-        for geom_element in tagged_geom:
-            geom_element.tag = False
+    def _check_mesh_versions(self):
+        # State cached from the meshes is dropped when any of them changed since
+        mesh_versions = {obj: get_mesh_version(obj, bm) for obj, bm in self._bms.items()}
+        if mesh_versions != self._mesh_versions:
+            self._clean()
+            self._selection_original = None
+            self._selection_persistent = None
+            self._mesh_versions = mesh_versions
+
+    def _get_pattern_buffer(self, context):
+        # Pattern buffer is resampled only after the preview was rendered again or the resolution changed
+        ps_tool_settings = self._get_tool_settings(context)
+        if ps_tool_settings.pattern_source not in ("OBJECT", "IMAGE"):
+            return None
+
+        pattern_version = (get_preview_version(), ps_tool_settings.pattern_resolution)
+        if self._pattern_buffer is None or self._pattern_version != pattern_version:
+            self._pattern_buffer = get_selection_pattern_buffer(ps_tool_settings.pattern_resolution)
+            self._pattern_version = pattern_version
+        return self._pattern_buffer
+
+    def _clean_persistent_selection(self):
+        self._selection_persistent = None
+
+    def _get_selection(self):
+        return {obj: get_selection_masks(obj) for obj in self._bms}
+
+    def _set_selection(self, selection, current_selection):
+        for obj, bm in self._bms.items():
+            set_selection_masks(bm, selection[obj], current_selection[obj], bm.select_mode)
 
 
 
@@ -642,8 +1087,9 @@ class Helper:
 
 
     def _check_init_attribs(self, force=False):
-        names = ("_set_continue", "_bms", "_snap_point", "_snap_edge", "_snap_edge_co", "_loop",
-                 "_geom_selected_original", "_extend_to_loop", "_select_enabled", "_pattern_buffer")
+        names = ("_set_continue", "_bms", "_snap_point", "_snap_edge", "_snap_edge_co", "_loop", "_loop_co",
+                 "_loop_2d", "_loop_mask", "_selection_original", "_selection_persistent", "_extend_to_loop",
+                 "_select_enabled", "_pattern_buffer", "_pattern_version", "_stroke", "_mesh_versions")
         for name in names:
             if force or not hasattr(self, name):
                 setattr(self, name, None)
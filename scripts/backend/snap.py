@@ -0,0 +1,55 @@
+import bpy
+from bpy.app.handlers import persistent
+
+from .mirror import free_mesh_mirrors
+from .projection import free_region_projections
+from .topology import get_object_geometry_version, tag_object_geometry_update, free_mesh_caches
+from .utils import create_bvhtree, get_unique_objects
+
+
+snap_bvh_cache = {}
+
+
+def get_snap_bvh_key(obj):
+    return obj.data.as_pointer(), get_object_geometry_version(obj)
+
+
+def get_snap_bvhs(depsgraph=None):
+    # Object space BVH trees of the edited objects, only objects changed since the last call are rebuilt
+    objects = get_unique_objects()
+    bvhs = {}
+    for obj in objects:
+        pointer = obj.as_pointer()
+        key = get_snap_bvh_key(obj)
+        cached = snap_bvh_cache.get(pointer)
+        if cached is None or cached[0] != key:
+            if depsgraph is None:
+                depsgraph = bpy.context.evaluated_depsgraph_get()
+            cached = (key, create_bvhtree(obj, depsgraph))
+        bvhs[pointer] = cached
+
+    # Objects removed from the edit mode are dropped
+    snap_bvh_cache.clear()
+    snap_bvh_cache.update(bvhs)
+    return [(obj, bvhs[obj.as_pointer()][1]) for obj in objects]
+
+
+def free_snap_bvhs():
+    snap_bvh_cache.clear()
+
+
+@persistent
+def snap_bvh_depsgraph_update(scene, depsgraph):
+    # Trees are built from the evaluated objects, so they are dropped on any of their geometry updates, also on
+    # modifier changes which leave the edit mesh as it is
+    for update in depsgraph.updates:
+        if update.is_updated_geometry and isinstance(update.id, bpy.types.Object):
+            obj = update.id.original
+            if tag_object_geometry_update(obj):
+                snap_bvh_cache.pop(obj.as_pointer(), None)
+
+    if bpy.context.mode != 'EDIT_MESH':
+        free_snap_bvhs()
+        free_region_projections()
+        free_mesh_mirrors()
+        free_mesh_caches()
@@ -0,0 +1,356 @@
+import bmesh
+import numpy
+
+
+topology_cache = {}
+normals_cache = {}
+objects_geometry_version = {}
+objects_geometry_version_frozen = False
+
+
+def foreach_get_array(collection, attr, dtype, size=1):
+    array = numpy.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, array)
+    return array.reshape(-1, size) if size > 1 else array
+
+
+def csr_offsets(keys, length):
+    offsets = numpy.zeros(length + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(keys, minlength=length), out=offsets[1:])
+    return offsets
+
+
+def csr_ranges(starts, counts):
+    # Flat positions of all [start, start + count) ranges, in order
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    ends = numpy.cumsum(counts)
+    shift = numpy.repeat(numpy.asarray(starts, dtype=numpy.int64) - ends + counts, counts)
+    return numpy.arange(ends[-1] if ends.size else 0, dtype=numpy.int64) + shift
+
+
+def label_components(length, a, b):
+    # Connected components of the graph with a[i] - b[i] links, labelled by their smallest element
+    labels = numpy.arange(length)
+    while a.size:
+        label_a, label_b = labels[a], labels[b]
+        differ = label_a != label_b
+        a, b = a[differ], b[differ]
+        if not a.size:
+            break
+        label_a, label_b = label_a[differ], label_b[differ]
+        numpy.minimum.at(labels, numpy.maximum(label_a, label_b), numpy.minimum(label_a, label_b))
+        while True:
+            jumped = labels[labels]
+            if numpy.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+class MeshTopology:
+    def __init__(self, mesh, key=None):
+        self.key = key
+        self.verts_len = len(mesh.vertices)
+        self.edges_len = len(mesh.edges)
+        self.faces_len = len(mesh.polygons)
+        self.loops_len = len(mesh.loops)
+
+        self.edge_verts = foreach_get_array(mesh.edges, "vertices", numpy.int32, 2)
+        self.loop_vert = foreach_get_array(mesh.loops, "vertex_index", numpy.int32)
+        self.loop_edge = foreach_get_array(mesh.loops, "edge_index", numpy.int32)
+        self.face_loop_start = foreach_get_array(mesh.polygons, "loop_start", numpy.int32)
+        self.face_loop_total = foreach_get_array(mesh.polygons, "loop_total", numpy.int32)
+
+        # face -> loop
+        loops = numpy.arange(self.loops_len, dtype=numpy.int32)
+        self.loop_face = numpy.repeat(numpy.arange(self.faces_len, dtype=numpy.int32), self.face_loop_total)
+        face_loop_end = self.face_loop_start + self.face_loop_total - 1
+        self.loop_next = loops + 1
+        self.loop_next[face_loop_end] = self.face_loop_start
+        self.loop_prev = loops - 1
+        self.loop_prev[self.face_loop_start] = face_loop_end
+
+        # edge -> loop (and face), loops of one edge form the radial cycle
+        self.edge_loop_offsets = csr_offsets(self.loop_edge, self.edges_len)
+        self.edge_loops = numpy.argsort(self.loop_edge, kind="stable").astype(numpy.int32)
+        self.edge_faces_len = numpy.diff(self.edge_loop_offsets).astype(numpy.int32)
+        sorted_edge = self.loop_edge[self.edge_loops]
+        radial_start = self.edge_loop_offsets[sorted_edge]
+        radial_pos = (loops - radial_start + 1) % self.edge_faces_len[sorted_edge] + radial_start
+        self.loop_radial_next = numpy.empty_like(loops)
+        self.loop_radial_next[self.edge_loops] = self.edge_loops[radial_pos]
+
+        # vert -> edge
+        edge_verts_flat = self.edge_verts.ravel()
+        self.vert_edge_offsets = csr_offsets(edge_verts_flat, self.verts_len)
+        self.vert_edges = (numpy.argsort(edge_verts_flat, kind="stable") // 2).astype(numpy.int32)
+        self.vert_edges_len = numpy.diff(self.vert_edge_offsets).astype(numpy.int32)
+
+        self.edge_vert_next = self._create_edge_vert_next()
+
+        # Edge loops labelling and order, built on first use
+        self.edge_loop_id = None
+        self.edge_loop_side = None
+        self.loop_root = None
+        self.loop_is_cyclic = None
+        self.edge_loop_position = None
+        self.loop_edge_offsets = None
+        self.loop_edges = None
+
+    def _create_edge_vert_next(self):
+        # Next edge of the edge loop across each edge vertex (-1 where the loop stops), same steps as the bmesh edge
+        # loop walker: across four and two edge verts, around the largest face of edges at three edge verts when it is
+        # an ngon (hub), along mesh borders up to their corners and along the borders of single ngons. Verts count
+        # their edges with faces only, steps one of the two edges doesn't take back are dropped.
+        edge_vert_next = numpy.full((self.edges_len, 2), -1, dtype=numpy.int32)
+        if not self.loops_len:
+            return edge_vert_next
+
+        edges = numpy.arange(self.edges_len, dtype=numpy.int32)
+        edge_manifold = self.edge_faces_len == 2
+        edge_boundary = self.edge_faces_len == 1
+        vert_edges_tot = numpy.bincount(self.edge_verts[self.edge_faces_len > 0].ravel(), minlength=self.verts_len)
+        first_loop = self.edge_loops[numpy.minimum(self.edge_loop_offsets[:-1], self.loops_len - 1)]
+
+        # Hub edges have a vert with three edges and an ngon as their largest face (the first one on ties)
+        hub = numpy.flatnonzero((self.edge_faces_len > 1) & (vert_edges_tot[self.edge_verts] == 3).any(axis=1))
+        loops = self.edges_link_loops(hub)
+        loop_face_len = self.face_loop_total[self.loop_face[loops]]
+        hub_offsets = numpy.concatenate(([0], numpy.cumsum(self.edge_faces_len[hub])[:-1]))
+        hub_face_len = numpy.maximum.reduceat(loop_face_len, hub_offsets) if hub.size else hub
+        largest = numpy.flatnonzero(loop_face_len == numpy.repeat(hub_face_len, self.edge_faces_len[hub]))
+        loop_hub = numpy.repeat(numpy.arange(hub.size), self.edge_faces_len[hub])[largest]
+        largest = largest[numpy.diff(loop_hub, prepend=-1) != 0]
+        is_hub = numpy.zeros(self.edges_len, dtype=bool)
+        is_hub[hub] = hub_face_len > 4
+        hub_loop = numpy.zeros(self.edges_len, dtype=numpy.int32)
+        hub_loop[hub] = loops[largest]
+
+        is_normal = (self.edge_faces_len > 1) & ~is_hub
+        is_single = edge_boundary & (self.face_loop_total[self.loop_face[first_loop]] > 4) & \
+            (edge_boundary[self.loop_edge[self.loop_next[first_loop]]] |
+             edge_boundary[self.loop_edge[self.loop_prev[first_loop]]])
+
+        def other_edge_loop(l, v):
+            # Loop of the other edge of the face of l at v
+            return numpy.where(self.loop_vert[l] == v, self.loop_prev[l], self.loop_next[l])
+
+        for side in (0, 1):
+            v = self.edge_verts[:, side]
+            tot = vert_edges_tot[v]
+
+            # Across the opposite edge of four edge verts, or the other edge of two edge verts
+            normal = numpy.flatnonzero(is_normal & ((tot == 4) | (tot == 2)))
+            l = other_edge_loop(first_loop[normal], v[normal])
+            side_edges = self.loop_edge[l]
+            opposite_edges = self.loop_edge[other_edge_loop(self.loop_radial_next[l], v[normal])]
+            is_four = tot[normal] == 4
+            next_edges = numpy.where(is_four, opposite_edges, side_edges)
+            is_step = edge_manifold[side_edges] & edge_manifold[next_edges] & (next_edges != normal)
+            edge_vert_next[normal[is_step], side] = next_edges[is_step]
+
+            # Along the hub face, never onto a border
+            hub = numpy.flatnonzero(is_hub & (tot == 3))
+            l = hub_loop[hub]
+            next_edges = self.loop_edge[numpy.where(self.loop_vert[l] == v[hub], self.loop_prev[l], self.loop_next[l])]
+            is_step = ~edge_boundary[next_edges]
+            edge_vert_next[hub[is_step], side] = next_edges[is_step]
+
+            # Around the fan of border verts to the next border edge, not onto single ngon borders
+            border = numpy.flatnonzero(edge_boundary & ~is_single & (tot > 2))
+            next_edges = numpy.full(border.size, -1, dtype=numpy.int32)
+            active = numpy.arange(border.size)
+            l = first_loop[border]
+            while active.size:
+                l = other_edge_loop(l, v[border[active]])
+                fan_edges = self.loop_edge[l]
+                found = edge_boundary[fan_edges]
+                next_edges[active[found]] = fan_edges[found]
+                crossed = edge_manifold[fan_edges]
+                active, l = active[crossed], self.loop_radial_next[l[crossed]]
+            is_step = (next_edges >= 0) & (next_edges != border) & ~is_single[next_edges]
+            edge_vert_next[border[is_step], side] = next_edges[is_step]
+
+            # Along single ngon borders across two edge verts
+            single = numpy.flatnonzero(is_single & (tot == 2))
+            next_edges = self.loop_edge[other_edge_loop(first_loop[single], v[single])]
+            is_step = edge_boundary[next_edges] & (next_edges != single)
+            edge_vert_next[single[is_step], side] = next_edges[is_step]
+
+        is_mutual = numpy.zeros((self.edges_len, 2), dtype=bool)
+        for side in (0, 1):
+            has_next = numpy.flatnonzero(edge_vert_next[:, side] >= 0)
+            next_edges = edge_vert_next[has_next, side]
+            next_side = self.edge_verts[next_edges, 1] == self.edge_verts[has_next, side]
+            is_mutual[has_next, side] = edge_vert_next[next_edges, next_side.astype(numpy.int64)] == has_next
+        edge_vert_next[~is_mutual] = -1
+        return edge_vert_next
+
+    def _edge_loop_states(self):
+        # Walking states: (edge, entered side) as edge * 2 + side, the successor leaves through the other side
+        states = numpy.arange(self.edges_len * 2, dtype=numpy.int64)
+        next_edge = self.edge_vert_next[:, ::-1].ravel().astype(numpy.int64)
+        exit_vert = self.edge_verts[:, ::-1].ravel()
+        next_side = self.edge_verts[numpy.maximum(next_edge, 0), 1] == exit_vert
+        return states, numpy.where(next_edge >= 0, next_edge * 2 + next_side, -1)
+
+    def ensure_edge_loops(self):
+        if self.edge_loop_id is not None:
+            return
+
+        # Both walking directions of a loop are labelled by their first state, the loop by its first edge (root).
+        # Each loop is read in the walking direction which enters the root edge from side 0.
+        states, state_next = self._edge_loop_states()
+        has_next = state_next >= 0
+        edge_direction = label_components(states.size, states[has_next], state_next[has_next]).reshape(-1, 2)
+        edge_root = edge_direction.min(axis=1) // 2
+        is_root = edge_root == numpy.arange(self.edges_len)
+        edge_loop_id = (numpy.cumsum(is_root) - 1)[edge_root]
+        self.loop_root = numpy.flatnonzero(is_root)
+
+        loop_ends = numpy.bincount(edge_loop_id, weights=(self.edge_vert_next < 0).sum(axis=1),
+                                   minlength=self.loop_root.size)
+        self.loop_is_cyclic = loop_ends == 0
+        self.edge_loop_side = (edge_direction[:, 0] != edge_root * 2).astype(numpy.int8)
+        self.edge_loop_id = edge_loop_id.astype(numpy.int32)
+
+    def ensure_edge_loops_order(self):
+        if self.loop_edges is not None:
+            return
+        self.ensure_edge_loops()
+
+        # Closed loops are opened in front of their root edge (both walking directions)
+        states, state_next = self._edge_loop_states()
+        has_next = state_next >= 0
+        state_prev = numpy.full(states.size, -1, dtype=numpy.int64)
+        state_prev[state_next[has_next]] = states[has_next]
+        cyclic_roots = self.loop_root[self.loop_is_cyclic]
+        state_prev[numpy.concatenate((cyclic_roots * 2, cyclic_roots * 2 + 1))] = -1
+
+        # Position of every edge along its walk (pointer jumping list ranking)
+        edge_state = numpy.arange(self.edges_len, dtype=numpy.int64) * 2 + self.edge_loop_side
+        state_position = (state_prev >= 0).astype(numpy.int64)
+        jump = state_prev
+        active = edge_state[jump[edge_state] >= 0]
+        while active.size:
+            target = jump[active]
+            target_jump = jump[target]
+            state_position[active] += state_position[target]
+            jump[active] = target_jump
+            active = active[target_jump >= 0]
+        edge_loop_position = state_position[edge_state]
+
+        order = numpy.lexsort((edge_loop_position, self.edge_loop_id))
+        self.loop_edge_offsets = csr_offsets(self.edge_loop_id, self.loop_root.size)
+        self.loop_edges = order.astype(numpy.int32)
+        self.edge_loop_position = edge_loop_position.astype(numpy.int32)
+
+    def edge_loop(self, edge_index):
+        # Edges of the loop through edge_index, in walking order
+        self.ensure_edge_loops_order()
+        loop_id = self.edge_loop_id[edge_index]
+        return self.loop_edges[self.loop_edge_offsets[loop_id]:self.loop_edge_offsets[loop_id + 1]]
+
+    def edges_loops_mask(self, edges_mask):
+        # Edges lying on any of the loops through edges_mask
+        self.ensure_edge_loops()
+        loops_mask = numpy.zeros(self.loop_root.size, dtype=bool)
+        loops_mask[self.edge_loop_id[edges_mask]] = True
+        return loops_mask[self.edge_loop_id]
+
+    def vert_link_edges(self, vert_index):
+        return self.vert_edges[self.vert_edge_offsets[vert_index]:self.vert_edge_offsets[vert_index + 1]]
+
+    def edge_link_loops(self, edge_index):
+        return self.edge_loops[self.edge_loop_offsets[edge_index]:self.edge_loop_offsets[edge_index + 1]]
+
+    def edges_link_loops(self, edge_indices):
+        offsets = self.edge_loop_offsets
+        return self.edge_loops[csr_ranges(offsets[edge_indices], offsets[edge_indices + 1] - offsets[edge_indices])]
+
+    def faces_loops(self, face_indices):
+        return csr_ranges(self.face_loop_start[face_indices], self.face_loop_total[face_indices])
+
+
+class MeshNormals:
+    def __init__(self, key, mesh, topology):
+        self.key = key
+        self.face_normal = foreach_get_array(mesh.polygons, "normal", numpy.float32, 3)
+        self.face_area = foreach_get_array(mesh.polygons, "area", numpy.float32)
+
+        # Sum of the area weighted normals of the faces around each vert
+        face_normal_area = self.face_normal * self.face_area[:, None]
+        loop_normal_area = face_normal_area[topology.loop_face]
+        self.vert_normal_area = numpy.stack([numpy.bincount(topology.loop_vert, loop_normal_area[:, i],
+                                                            minlength=topology.verts_len) for i in range(3)], axis=1)
+
+    def verts_normal(self, verts):
+        # Area weighted average normal around the verts, in object space and not normalized
+        return self.vert_normal_area[verts].sum(axis=0)
+
+
+def get_object_geometry_version(obj):
+    return objects_geometry_version.get(obj.as_pointer(), 0)
+
+
+def tag_object_geometry_update(obj):
+    # Geometry update counter of the object, selection changes in edit mode are reported as geometry updates too.
+    # Returns whether the update was counted.
+    if objects_geometry_version_frozen:
+        return False
+    pointer = obj.as_pointer()
+    objects_geometry_version[pointer] = objects_geometry_version.get(pointer, 0) + 1
+    return True
+
+
+def freeze_objects_geometry_version(value=True):
+    # The tool only changes the selection, its own updates don't bump the counters while it runs
+    global objects_geometry_version_frozen
+    objects_geometry_version_frozen = value
+
+
+def free_mesh_caches():
+    # The caches are keyed by pointers, which new data can reuse once the edit mode is left
+    topology_cache.clear()
+    normals_cache.clear()
+    objects_geometry_version.clear()
+
+
+def get_mesh_version(obj, bm):
+    # Element counts and the geometry change counter, compared in O(1) by cached state
+    return len(bm.verts), len(bm.edges), len(bm.faces), get_object_geometry_version(obj)
+
+
+def get_mesh_topology(obj, bm=None, mesh_synced=False):
+    # Keyed by the geometry update counter as well, edits keeping the element counts reorder or relink elements
+    if bm is None:
+        bm = bmesh.from_edit_mesh(obj.data)
+    key = get_mesh_version(obj, bm)
+    data_pointer = obj.data.as_pointer()
+    topology = topology_cache.get(data_pointer)
+    if topology is None or topology.key != key:
+        if not mesh_synced:
+            obj.update_from_editmode()
+        topology = MeshTopology(obj.data, key)
+        topology_cache[data_pointer] = topology
+        bm.verts.index_update()
+        bm.edges.index_update()
+        bm.faces.index_update()
+    bm.verts.ensure_lookup_table()
+    bm.edges.ensure_lookup_table()
+    bm.faces.ensure_lookup_table()
+    return topology
+
+
+def get_mesh_normals(obj, bm=None, mesh_synced=False):
+    if bm is None:
+        bm = bmesh.from_edit_mesh(obj.data)
+    key = get_mesh_version(obj, bm)
+    data_pointer = obj.data.as_pointer()
+    normals = normals_cache.get(data_pointer)
+    if normals is None or normals.key != key:
+        if not mesh_synced:
+            obj.update_from_editmode()
+        normals = MeshNormals(key, obj.data, get_mesh_topology(obj, bm, mesh_synced=True))
+        normals_cache[data_pointer] = normals
+    return normals
@@ -1,7 +1,8 @@
 import bpy
-from bpy_extras.view3d_utils import region_2d_to_location_3d, region_2d_to_vector_3d, location_3d_to_region_2d
+import numpy
+from bpy_extras.view3d_utils import region_2d_to_location_3d, region_2d_to_vector_3d, region_2d_to_origin_3d
 from mathutils import Vector, Matrix
-from mathutils.geometry import intersect_point_line, intersect_line_line
+from mathutils.geometry import intersect_line_line
 from mathutils.kdtree import KDTree
 from mathutils.bvhtree import BVHTree
 
@@ -20,13 +21,46 @@ def is_backface(bm_element, eye_location, mtx=None, mtx_sr=None):
     return (bm_element.co - eye_location).dot(bm_element.normal) >= 0.0
 
 
-def points_3d_to_region_2d(points, region, rv3d):
-    return [i for i in (location_3d_to_region_2d(region, rv3d, p) for p in points) if all(i)]
+def backface_culling_mask(co, normals, eye_location, mtx=None, mtx_sr=None):
+    # Batched is_backface over (N, 3) coordinates and normals, True for the elements facing the eye. Matrices are
+    # applied to the coordinates and normals independently, when given.
+    co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+    normals = numpy.asarray(normals, dtype=numpy.float64).reshape(-1, 3)
+    if mtx is not None:
+        mtx = numpy.array(mtx, dtype=numpy.float64)
+        co = co @ mtx[:3, :3].T + mtx[:3, 3]
+    if mtx_sr is not None:
+        normals = normals @ numpy.array(mtx_sr, dtype=numpy.float64)[:3, :3].T
+    return numpy.einsum("ij,ij->i", co - numpy.asarray(eye_location, dtype=numpy.float64), normals) < 0.0
 
 
-def points_pairs_3d_to_region_2d(points_pairs, region, rv3d):
-    return [i for i in ((location_3d_to_region_2d(region, rv3d, p[0]),
-                         location_3d_to_region_2d(region, rv3d, p[1])) for p in points_pairs) if all(i)]
+def get_aligned_perspective_matrix(rv3d, view_location, view_normal):
+    # Perspective matrix of the view looking at view_location against view_normal, rv3d itself is not changed
+    view_rotation = view_normal.rotation_difference(Vector((0.0, 0.0, 1.0))).inverted()
+    view_matrix = (Matrix.Translation(view_location) @ view_rotation.to_matrix().to_4x4() @
+                   Matrix.Translation((0.0, 0.0, rv3d.view_distance))).inverted()
+    return rv3d.window_matrix @ view_matrix
+
+
+def get_eye_location(rv3d):
+    eye = Vector(rv3d.view_matrix[2][:3])
+    if not rv3d.is_perspective:
+        eye.length = 10000  # change to clip_end
+    else:
+        eye.length = rv3d.view_distance
+    return rv3d.view_location + eye
+
+
+def points_3d_to_region_2d(points, region, perspective_matrix):
+    # Batched location_3d_to_region_2d: (N, 3) points to (N, 2) region coordinates and a mask of points in front
+    # of the view. Coordinates of masked out points are undefined, indices are preserved.
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    mtx = numpy.array(perspective_matrix, dtype=numpy.float64)
+    prj = points @ mtx[:, :3].T + mtx[:, 3]
+    valid = prj[:, 3] > 0.0
+    w = numpy.where(valid, prj[:, 3], 1.0)
+    half_size = numpy.array((region.width / 2.0, region.height / 2.0))
+    return half_size + half_size * prj[:, :2] / w[:, None], valid
 
 
 def region_2d_to_points_3d(pos, region, rv3d):
@@ -34,11 +68,25 @@ def region_2d_to_points_3d(pos, region, rv3d):
     return region_2d_to_location_3d(region, rv3d, pos, vec)
 
 
-def intersect_point_section_2d(pt, p1, p2):
-    p, distance = intersect_point_line(pt, p1, p2)
-    if min(p1[0], p2[0]) <= p[0] <= max(p1[0], p2[0]) and min(p1[1], p2[1]) <= p[1] <= max(p[1], p2[1]):
-        return p, distance
-    return p1 if (p1 - p).length < (p2 - p).length else p2, distance
+def region_2d_to_ray_3d(pos, region, rv3d):
+    return region_2d_to_origin_3d(region, rv3d, pos), region_2d_to_vector_3d(region, rv3d, pos)
+
+
+def closest_points_on_sections_2d(pt, sections):
+    # For (N, 2, 2) sections returns the points closest to pt, their factors along the sections, the midpoints and
+    # the endpoints nearest to pt
+    sections = numpy.asarray(sections, dtype=numpy.float64).reshape(-1, 2, 2)
+    pt = numpy.asarray(pt, dtype=numpy.float64)[:2]
+    p1, p2 = sections[:, 0], sections[:, 1]
+    direction = p2 - p1
+    length_squared = numpy.einsum("ij,ij->i", direction, direction)
+    factor = numpy.einsum("ij,ij->i", pt - p1, direction) / numpy.where(length_squared > 0.0, length_squared, 1.0)
+    factor = numpy.clip(factor, 0.0, 1.0)
+    closest = p1 + direction * factor[:, None]
+    midpoints = (p1 + p2) / 2.0
+    nearest = ((p1 - pt) ** 2).sum(axis=1) <= ((p2 - pt) ** 2).sum(axis=1)
+    endpoints = numpy.where(nearest[:, None], p1, p2)
+    return closest, factor, midpoints, endpoints
 
 
 def create_kdtree(points):
@@ -4,7 +4,8 @@ from .properties import PerfectSelectOperatorProperties, ExtendToEdgeLoopsOperat
 from .backend.select import (extend_to_edge_loops_execute,
                              perfect_select_invoke,
                              perfect_select_execute,
-                             perfect_select_modal)
+                             perfect_select_modal,
+                             perfect_select_cancel)
 
 class PERFECT_SELECT_OT_extend_to_edge_loops(ExtendToEdgeLoopsOperatorProperties, Operator):
     bl_label = "Extend to Boundary Loops"
@@ -42,6 +43,9 @@ class PERFECT_SELECT_OT_perfect_select(PerfectSelectOperatorProperties, Operator
     def modal(self, context, event):
         return perfect_select_modal(context, event, self)
 
+    def cancel(self, context):
+        perfect_select_cancel(context, self)
+
     def clean_status_text(self, context):
         context.workspace.status_text_set(None)
 
@@ -56,8 +60,7 @@ class PERFECT_SELECT_OT_perfect_select(PerfectSelectOperatorProperties, Operator
             elements = release_elements + elements + input_elements
         else:
             extend_elements = [("Shift⇧", "Extend to Widest Boundary Loops"),
-                               # ("Ctrl", "Reduce to Narrowest Boundary Loops")
-                               ]
+                               ("Ctrl", "Reduce to Narrowest Boundary Loops")]
             elements.extend(extend_elements)
 
         return "        ".join("[{}] {}".format(*e) for e in elements)
@@ -1,4 +1,5 @@
 import os
+import hashlib
 
 import bpy
 import bgl
@@ -7,19 +8,44 @@ import numpy
 
 from math import radians
 
+from bpy.app.handlers import persistent
 from bpy.utils import previews
 from mathutils import Matrix, Vector, Color, Euler
 from gpu_extras.batch import batch_for_shader
 
+from .backend.topology import foreach_get_array, csr_ranges
+
 
 PREVIEW_WIDTH = 512
 PREVIEW_HEIGHT = 512
 
+# Most recently used pattern masks kept on disk
+PATTERN_CACHE_SIZE = 64
+
+
+# Image right and up axes of the pattern seen from each projection side
+PATTERN_PROJECTION_AXES = {
+    "X": ((0.0, -1.0, 0.0), (0.0, 0.0, 1.0)),
+    "-X": ((0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+    "Y": ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    "-Y": ((-1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    "Z": ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)),
+    "-Z": ((1.0, 0.0, 0.0), (0.0, -1.0, 0.0)),
+}
+
 
 PREVIEW_SHADER_VERT = None
 PREVIEW_SHADER_FRAG = None
 
 preview_collection = None
+preview_version = 0
+pattern_alpha = None
+pattern_buffers = {}
+pattern_sats = {}
+
+
+def get_preview_version():
+    return preview_version
 
 
 def get_preview():
@@ -63,12 +89,9 @@ def render(image, check_size):
     return buffer
 
 
-def render_preview(scene=None, obj=None, camera_obj=None, axis=None, resolution=512, only_chess=False):
+def render_preview(scene=None, obj=None, camera_obj=None, axis=None, resolution=512):
     preview = get_preview()
-    if only_chess:
-        image = bpy.data.images.new("_tmp_perfect_select_img", PREVIEW_WIDTH, PREVIEW_HEIGHT, alpha=True)
-        image.pixels = preview.image_pixels_float[:]
-    elif obj.bl_rna.name == "Image":
+    if obj.bl_rna.name == "Image":
         image = obj.copy()
         image.scale(PREVIEW_WIDTH, PREVIEW_HEIGHT)
     else:
@@ -112,9 +135,12 @@ def render_preview(scene=None, obj=None, camera_obj=None, axis=None, resolution=
 
         _get_render_result(scene, image)
 
+    global preview_version
     buffer = render(image, 64 / (512/resolution))
     if buffer is not None:
         preview.image_pixels_float = buffer
+        preview_version += 1
+        clear_pattern_buffers()
 
     bpy.data.images.remove(image)
     return buffer
@@ -148,6 +174,147 @@ def get_active_color(alpha=1.0):
     return (*bpy.context.preferences.themes[0].view_3d.vertex_select, alpha)
 
 
+def rasterize_triangles(triangles_2d, width, height):
+    # Pixels with the center inside any of the (T, 3, 2) pixel space triangles. Each triangle row span is added to a
+    # difference array, filled with one cumsum.
+    mask_diff = numpy.zeros((height, width + 1), dtype=numpy.int32)
+    triangles_y = triangles_2d[:, :, 1]
+    rows_start = numpy.clip(numpy.ceil(triangles_y.min(axis=1) - 0.5), 0, height).astype(numpy.int64)
+    rows_end = numpy.clip(numpy.floor(triangles_y.max(axis=1) - 0.5) + 1, 0, height).astype(numpy.int64)
+    rows_len = numpy.maximum(rows_end - rows_start, 0)
+    rows = csr_ranges(rows_start, rows_len)
+    p0 = triangles_2d[numpy.repeat(numpy.arange(len(triangles_2d)), rows_len)]
+    p1 = p0[:, (1, 2, 0)]
+
+    # Row center crossings of the triangle edges
+    row_y = (rows + 0.5)[:, None]
+    (x0, y0), (x1, y1) = numpy.moveaxis(p0, 2, 0), numpy.moveaxis(p1, 2, 0)
+    crossing = (numpy.minimum(y0, y1) <= row_y) & (row_y <= numpy.maximum(y0, y1)) & (y0 != y1)
+    x = x0 + (row_y - y0) * (x1 - x0) / numpy.where(y0 != y1, y1 - y0, 1.0)
+    x_min = numpy.where(crossing, x, numpy.inf).min(axis=1)
+    x_max = numpy.where(crossing, x, -numpy.inf).max(axis=1)
+
+    span_start = numpy.clip(numpy.ceil(x_min - 0.5), 0, width)
+    span_end = numpy.clip(numpy.floor(x_max - 0.5) + 1, 0, width)
+    spans = span_start < span_end
+    rows = rows[spans]
+    numpy.add.at(mask_diff, (rows, span_start[spans].astype(numpy.int64)), 1)
+    numpy.add.at(mask_diff, (rows, span_end[spans].astype(numpy.int64)), -1)
+    return numpy.cumsum(mask_diff[:, :width], axis=1) > 0
+
+
+def compose_preview_pixels(mask, check_size):
+    # Preview RGBA pixels of the mask, as drawn by the image_preview shader
+    height, width = mask.shape
+    y, x = numpy.mgrid[0:height, 0:width] + 0.5
+    checker = numpy.mod(numpy.floor(check_size * (x / width - 0.5)) + numpy.floor(check_size * (y / height - 0.5)),
+                        2.0)
+    checker_color = numpy.stack((checker, checker, checker, numpy.ones_like(checker)), axis=-1)
+
+    pattern_color = numpy.array(get_active_color())
+    pattern_color_dark = numpy.array((*(pattern_color[:3] * 0.3), 1.0))
+    d = (numpy.hypot(x - width * 0.5, y - height * 0.5) * 0.001)[..., None]
+    final_color = pattern_color * (1.0 - d) + pattern_color_dark * d
+
+    pixels = checker_color * 0.1 + final_color * 0.9
+    pixels[~mask] = 0.0
+    return pixels.astype(numpy.float32).ravel()
+
+
+def rasterize_pattern_mask(obj, mesh, axis):
+    # Orthographic pattern of the mesh triangles, framed like the camera of _create_tmp_scene_and_render. Masks are
+    # cached on disk by the mesh content.
+    mesh.calc_loop_triangles()
+    verts_co = foreach_get_array(mesh.vertices, "co", numpy.float32, 3)
+    triangles = foreach_get_array(mesh.loop_triangles, "vertices", numpy.int32, 3)
+    bound_box = numpy.array([b[:] for b in obj.bound_box])
+
+    key = get_pattern_key("OBJECT", axis, verts_co, triangles, bound_box)
+    mask = load_pattern_mask(key)
+    if mask is not None:
+        return mask
+
+    bounds_center = bound_box.mean(axis=0)
+    bounds_len = numpy.maximum(bound_box.max(axis=0) - bound_box.min(axis=0), 0.1)
+    axis_right, axis_up = numpy.array(PATTERN_PROJECTION_AXES[axis])
+    ortho_scale = max(numpy.abs(axis_right) @ bounds_len, numpy.abs(axis_up) @ bounds_len)
+
+    co_2d = (verts_co - bounds_center) @ numpy.stack((axis_right, axis_up), axis=1) / ortho_scale + 0.5
+    co_2d *= (PREVIEW_WIDTH, PREVIEW_HEIGHT)
+    mask = rasterize_triangles(co_2d[triangles], PREVIEW_WIDTH, PREVIEW_HEIGHT)
+    save_pattern_mask(key, mask)
+    return mask
+
+
+def set_preview_mask(mask, resolution):
+    global preview_version, pattern_alpha
+    preview = get_preview()
+    preview.image_pixels_float.foreach_set(compose_preview_pixels(mask, 64 / (512/resolution)))
+    preview_version += 1
+    clear_pattern_buffers()
+    pattern_alpha = mask.T
+
+
+#
+# Pattern masks disk cache
+#
+
+def get_pattern_cache_dir():
+    return bpy.utils.user_resource('DATAFILES', path=os.path.join("perfect_select", "patterns"), create=True)
+
+
+def get_pattern_key(*parts):
+    pattern_hash = hashlib.sha1()
+    for part in parts:
+        pattern_hash.update(part.tobytes() if isinstance(part, numpy.ndarray) else str(part).encode())
+    return pattern_hash.hexdigest()
+
+
+def load_pattern_mask(key):
+    # Masks are memory-mapped, pages are read only when the pattern is sampled. The file is touched to mark it as
+    # recently used.
+    path = os.path.join(get_pattern_cache_dir(), key + ".npy")
+    if not os.path.exists(path):
+        return None
+    try:
+        mask = numpy.load(path, mmap_mode="r")
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return mask if mask.shape == (PREVIEW_HEIGHT, PREVIEW_WIDTH) and mask.dtype == bool else None
+
+
+def save_pattern_mask(key, mask):
+    path = os.path.join(get_pattern_cache_dir(), key + ".npy")
+    try:
+        with open(path + ".tmp", "wb") as file:
+            numpy.save(file, numpy.ascontiguousarray(mask, dtype=bool))
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    prune_pattern_cache()
+
+
+def prune_pattern_cache():
+    # Least recently used masks past the cache size are removed, files which can't be read or removed are skipped
+    try:
+        entries = [entry for entry in os.scandir(get_pattern_cache_dir()) if entry.name.endswith(".npy")]
+    except OSError:
+        return
+
+    paths_mtime = {}
+    for entry in entries:
+        try:
+            paths_mtime[entry.path] = entry.stat().st_mtime
+        except OSError:
+            pass
+    for path in sorted(paths_mtime, key=paths_mtime.get, reverse=True)[PATTERN_CACHE_SIZE:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 #
 # Properties functions
 #
@@ -203,37 +370,114 @@ def _create_tmp_scene_and_render(context, obj, axis, resolution):
     return pixels
 
 
-def _create_from_image_and_render(context, image, resolution):
+def _rasterize_object(context, obj, axis, resolution):
+    obj_eval = obj.evaluated_get(context.evaluated_depsgraph_get())
+    mesh = obj_eval.to_mesh()
+    try:
+        mask = rasterize_pattern_mask(obj_eval, mesh, axis)
+    finally:
+        obj_eval.to_mesh_clear()
+    set_preview_mask(mask, resolution)
+
+
+def _create_from_image_and_render(context, image, resolution, use_render=True):
+    image_pixels = numpy.empty(len(image.pixels), dtype=numpy.float32)
+    image.pixels.foreach_get(image_pixels)
+    key = get_pattern_key("IMAGE", tuple(image.size), image_pixels)
+    mask = load_pattern_mask(key)
+    if mask is not None:
+        set_preview_mask(mask, resolution)
+        return
+    if not use_render:
+        return
+
     pixels = render_preview(None, image, None, None, resolution)
+    if pixels is not None:
+        save_pattern_mask(key, get_pattern_alpha().T)
     return pixels
 
 
-def update_preview(self, context):
-    if self.pattern_source == "OBJECT":
-        if self.pattern_data is None:
+def _update_preview(ps_tool_settings, context, use_render=True):
+    if ps_tool_settings.pattern_source == "OBJECT":
+        if ps_tool_settings.pattern_data is None:
             return
-        _create_tmp_scene_and_render(context, self.pattern_data, self.pattern_projection, self.pattern_resolution)
-    elif self.pattern_source == "IMAGE":
-        if self.pattern_data_image is None or not self.pattern_data_image.has_data:
+        if ps_tool_settings.pattern_data.type == "GPENCIL":
+            if use_render:
+                _create_tmp_scene_and_render(context, ps_tool_settings.pattern_data,
+                                             ps_tool_settings.pattern_projection, ps_tool_settings.pattern_resolution)
+        else:
+            _rasterize_object(context, ps_tool_settings.pattern_data, ps_tool_settings.pattern_projection,
+                              ps_tool_settings.pattern_resolution)
+    elif ps_tool_settings.pattern_source == "IMAGE":
+        if ps_tool_settings.pattern_data_image is None or not ps_tool_settings.pattern_data_image.has_data:
             return
-        _create_from_image_and_render(context, self.pattern_data_image, self.pattern_resolution)
+        _create_from_image_and_render(context, ps_tool_settings.pattern_data_image,
+                                      ps_tool_settings.pattern_resolution, use_render)
+
+
+def update_preview(self, context):
+    _update_preview(self, context)
+
+
+@persistent
+def restore_preview(_dummy):
+    # Previews are not saved with the file, the pattern of the loaded scene is rasterized again or restored from the
+    # disk cache. Patterns which need a render are rendered only with a GPU.
+    clear_pattern_buffers()
+    _update_preview(bpy.context.scene.perfect_select_tool_settings, bpy.context, use_render=not bpy.app.background)
 
 
 def update_preview_chess(self, context):
-    render_preview(resolution=self.pattern_resolution, only_chess=True)
+    # Only the checker depends on the resolution, the preview is composed again from the pattern mask on the CPU. The
+    # mask and the buffers resampled from it are kept.
+    mask = get_pattern_alpha().T
+    get_preview().image_pixels_float.foreach_set(compose_preview_pixels(mask, 64 / (512/self.pattern_resolution)))
+
+
+def clear_pattern_buffers():
+    global pattern_alpha
+    pattern_alpha = None
+    pattern_buffers.clear()
+    pattern_sats.clear()
+
+
+def get_pattern_alpha():
+    # Preview alpha as a mask indexed by [x][y], read once per rendered preview
+    global pattern_alpha
+    if pattern_alpha is None:
+        pixels = numpy.empty(PREVIEW_WIDTH * PREVIEW_HEIGHT * 4, dtype=numpy.float32)
+        get_preview().image_pixels_float.foreach_get(pixels)
+        pattern_alpha = pixels[3::4].reshape((PREVIEW_HEIGHT, PREVIEW_WIDTH)).T > 0.0
+    return pattern_alpha
 
 
 def get_selection_pattern_buffer(resolution):
-    preview = get_preview()
-    pixels = preview.image_pixels_float
-    pixels_buffer = numpy.asarray(pixels, dtype=numpy.bool)
-    pixels_buffer = pixels_buffer[3::4]
-    pixels_buffer = pixels_buffer.reshape((PREVIEW_WIDTH, PREVIEW_HEIGHT))
-    pattern_buffer = numpy.asarray([[pixels_buffer[PREVIEW_WIDTH * h // resolution][PREVIEW_HEIGHT * w // resolution]
-                                     for h in range(resolution)] for w in range(resolution)])
+    # Preview alpha resampled by area, a pattern pixel is set when at least half of the preview pixels it covers are
+    pattern_buffer = pattern_buffers.get(resolution)
+    if pattern_buffer is None:
+        alpha = get_pattern_alpha()
+        x_starts = -(-numpy.arange(resolution) * PREVIEW_WIDTH // resolution)
+        y_starts = -(-numpy.arange(resolution) * PREVIEW_HEIGHT // resolution)
+        coverage = numpy.add.reduceat(numpy.add.reduceat(alpha.astype(numpy.float32), x_starts, axis=0),
+                                      y_starts, axis=1)
+        pixels_count = numpy.outer(numpy.diff(x_starts, append=PREVIEW_WIDTH),
+                                   numpy.diff(y_starts, append=PREVIEW_HEIGHT))
+        pattern_buffer = coverage >= pixels_count / 2
+        pattern_buffers[resolution] = pattern_buffer
     return pattern_buffer
 
 
+def get_selection_pattern_sat(resolution):
+    # Summed-area table of the pattern buffer, padded with a zero row and column
+    pattern_sat = pattern_sats.get(resolution)
+    if pattern_sat is None:
+        pattern_sat = numpy.zeros((resolution + 1, resolution + 1), dtype=numpy.int32)
+        pattern_buffer = get_selection_pattern_buffer(resolution)
+        numpy.cumsum(numpy.cumsum(pattern_buffer, axis=0, dtype=numpy.int32), axis=1, out=pattern_sat[1:, 1:])
+        pattern_sats[resolution] = pattern_sat
+    return pattern_sat
+
+
 def register():
     global preview_collection, PREVIEW_SHADER_VERT, PREVIEW_SHADER_FRAG
     preview_collection = previews.new()
@@ -249,5 +493,6 @@ def unregister():
     global preview_collection, PREVIEW_SHADER_VERT, PREVIEW_SHADER_FRAG
     preview_collection.close()
     preview_collection = None
+    clear_pattern_buffers()
     PREVIEW_SHADER_VERT = None
     PREVIEW_SHADER_FRAG = None
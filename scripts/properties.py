@@ -1,11 +1,11 @@
 import bpy
 
 from bpy.props import (EnumProperty, BoolProperty, BoolVectorProperty,
-                       IntProperty, FloatVectorProperty, StringProperty, PointerProperty)
+                       IntProperty, FloatProperty, FloatVectorProperty, StringProperty, PointerProperty)
 
 from .backend import get_platform_backend_modules, get_default_module_name, import_backend_module
-from .previews import update_preview, update_preview_chess
-from .backend.utils import create_bvhtree, get_unique_objects
+from .previews import update_preview, update_preview_chess, restore_preview
+from .backend.snap import free_snap_bvhs, snap_bvh_depsgraph_update
 
 
 def filter_objects(self, object):
@@ -53,6 +53,9 @@ class PerfectSelectToolSettings(bpy.types.PropertyGroup):
                                                 update=update_preview, type=bpy.types.Image, poll=filter_images)
     pattern_resolution:         IntProperty(name="Resolution", min=32, max=512, default=256,
                                             update=update_preview_chess)
+    pattern_coverage:           FloatProperty(name="Coverage", min=0.0, max=1.0, default=0.5, subtype='FACTOR',
+                                              description="Part of an edge or face which has to be inside the "
+                                                          "pattern to stay selected")
     pattern_projection:         EnumProperty(name="Projection",
                                              items=(("X", "Left", "Left"),
                                                     ("-X", "Right", "Right"),
@@ -68,20 +71,8 @@ class PerfectSelectToolSettings(bpy.types.PropertyGroup):
                                                     ("IMAGE", "Image", "Image"),),
                                              default="CIRCLE", update=update_preview)
 
-    snap_bvh = None
     snap_co = None
 
-    @classmethod
-    def create_snap_bvh(cls):
-        cls.snap_bvh = []
-        for obj in get_unique_objects():
-            cls.snap_bvh.append(create_bvhtree(obj, bpy.context.evaluated_depsgraph_get()))
-
-    @classmethod
-    def update_snap_co(cls, xy):
-        if not cls.snap_bvh:
-            cls.create_snap_bvh()
-
 
 def update_backend_module(self, context):
     import_backend_module()
@@ -98,11 +89,16 @@ class PerfectSelectAddonPreferences(bpy.types.AddonPreferences):
                ] + [(m, m, '') for m in get_platform_backend_modules()],
         update=update_backend_module
     )
+    frame_time_budget: IntProperty(name="Frame Time Budget (ms)", min=4, max=100, default=16,
+                                   description="Milliseconds per frame spent on updating the selection while "
+                                               "stroking, slower updates skip frames")
 
     def draw(self, context):
         layout = self.layout
         row = layout.row()
         row.prop(self, 'backend_module')
+        row = layout.row()
+        row.prop(self, 'frame_time_budget')
 
         # if self.default_backend_module is None:
         #    addon_fake_module = addon_utils.addons_fake_modules['perfect_select']
@@ -114,9 +110,14 @@ def register():
     bpy.utils.register_class(PerfectSelectToolSettings)
     bpy.utils.register_class(PerfectSelectAddonPreferences)
     bpy.types.Scene.perfect_select_tool_settings = bpy.props.PointerProperty(type=PerfectSelectToolSettings)
+    bpy.app.handlers.depsgraph_update_post.append(snap_bvh_depsgraph_update)
+    bpy.app.handlers.load_post.append(restore_preview)
 
 
 def unregister():
+    bpy.app.handlers.load_post.remove(restore_preview)
+    bpy.app.handlers.depsgraph_update_post.remove(snap_bvh_depsgraph_update)
+    free_snap_bvhs()
     del bpy.types.Scene.perfect_select_tool_settings
     bpy.utils.unregister_class(PerfectSelectAddonPreferences)
     bpy.utils.unregister_class(PerfectSelectToolSettings)
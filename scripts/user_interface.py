@@ -115,6 +115,7 @@ class PerfectSelectTool(WorkSpaceTool):
                 or tool_settings.pattern_source == "IMAGE" and tool_settings.pattern_data_image:
             sub = layout if is_header else layout.column(align=True)
             sub.prop(tool_settings, "pattern_resolution")
+            sub.prop(tool_settings, "pattern_coverage")
             if tool_settings.pattern_source == "OBJECT":
                 sub.prop(tool_settings, "pattern_projection")
 
@@ -132,7 +133,6 @@ class PerfectSelectTool(WorkSpaceTool):
             return
 
         tool_settings = context.scene.perfect_select_tool_settings
-        tool_settings.update_snap_co(xy)
         props = tool.operator_properties("perfect_select.perfect_select")
         if tool_settings.pattern_source == "CIRCLE":
             draw_circle_2d(xy, (1.0,) * 4, props.radius, segments=32)
@@ -0,0 +1,74 @@
+import numpy
+import pytest
+
+bpy = pytest.importorskip("bpy")
+bmesh = pytest.importorskip("bmesh")
+select = pytest.importorskip("perfect_select.backend.select")
+topology = pytest.importorskip("perfect_select.backend.topology")
+
+
+PRIMITIVES = [
+    ("primitive_cylinder_add", {"vertices": 9}),
+    ("primitive_circle_add", {"vertices": 12, "fill_type": 'NGON'}),
+    ("primitive_circle_add", {"vertices": 12, "fill_type": 'TRIFAN'}),
+    ("primitive_cone_add", {"vertices": 10}),
+    ("primitive_grid_add", {"x_subdivisions": 5, "y_subdivisions": 4}),
+]
+
+
+@pytest.fixture
+def edit_object(request):
+    operator, kwargs = request.param
+    bpy.ops.object.select_all(action='DESELECT')
+    getattr(bpy.ops.mesh, operator)(**kwargs)
+    obj = bpy.context.active_object
+    bpy.ops.object.mode_set(mode='EDIT')
+    try:
+        yield obj
+    finally:
+        bpy.ops.object.mode_set(mode='OBJECT')
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        bpy.data.meshes.remove(mesh)
+
+
+def loop_multi_select(obj, edge_index):
+    # Edges selected by the edge loop operator from edge_index
+    bm = bmesh.from_edit_mesh(obj.data)
+    bm.select_mode = {'EDGE'}
+    for edge in bm.edges:
+        edge.select_set(False)
+    bm.edges.ensure_lookup_table()
+    bm.edges[edge_index].select_set(True)
+    bmesh.update_edit_mesh(obj.data)
+    bpy.ops.mesh.loop_multi_select(ring=False)
+    return {e.index for e in bmesh.from_edit_mesh(obj.data).edges if e.select}
+
+
+@pytest.mark.parametrize("edit_object", PRIMITIVES, indirect=True)
+def test_edge_loops_match_loop_multi_select(edit_object):
+    obj = edit_object
+    obj.update_from_editmode()
+    mesh_topology = topology.MeshTopology(obj.data)
+    for edge_index in range(mesh_topology.edges_len):
+        assert set(mesh_topology.edge_loop(edge_index).tolist()) == loop_multi_select(obj, edge_index), edge_index
+
+
+@pytest.mark.parametrize("edit_object", PRIMITIVES[:1] + PRIMITIVES[-1:], indirect=True)
+def test_edge_loops_stop_at_hidden_edges(edit_object):
+    obj = edit_object
+    obj.update_from_editmode()
+    mesh_topology = topology.MeshTopology(obj.data)
+    edge_index = next(e for e in range(mesh_topology.edges_len) if len(mesh_topology.edge_loop(e)) > 2)
+    loop = mesh_topology.edge_loop(edge_index)
+    bm = bmesh.from_edit_mesh(obj.data)
+    bm.edges.ensure_lookup_table()
+    bm.edges[int(next(e for e in loop[len(loop) // 2:] if e != edge_index))].hide_set(True)
+    bmesh.update_edit_mesh(obj.data)
+
+    obj.update_from_editmode()
+    edge_hide = topology.foreach_get_array(obj.data.edges, "hide", bool)
+    edges = numpy.zeros(mesh_topology.edges_len, dtype=bool)
+    edges[edge_index] = True
+    loop_edges = select.get_loop_edges(mesh_topology, edges, edge_hide)
+    assert set(numpy.flatnonzero(loop_edges).tolist()) == loop_multi_select(obj, edge_index)
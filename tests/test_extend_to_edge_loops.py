@@ -0,0 +1,81 @@
+import pytest
+
+bpy = pytest.importorskip("bpy")
+bmesh = pytest.importorskip("bmesh")
+select = pytest.importorskip("perfect_select.backend.select")
+topology = pytest.importorskip("perfect_select.backend.topology")
+
+
+GRID_SIZE = 8
+
+
+def block(x, y, width, height):
+    return {(i, j) for i in range(x, x + width) for j in range(y, y + height)}
+
+
+def reduce_to_boundary_loops(faces):
+    # Inner extend on a grid of quads, faces as (column, row)
+    bm = bmesh.new()
+    verts = [[bm.verts.new((i, j, 0.0)) for i in range(GRID_SIZE + 1)] for j in range(GRID_SIZE + 1)]
+    for j in range(GRID_SIZE):
+        for i in range(GRID_SIZE):
+            bm.faces.new((verts[j][i], verts[j][i + 1], verts[j + 1][i + 1], verts[j + 1][i]))
+    bm.faces.ensure_lookup_table()
+    for i, j in faces:
+        bm.faces[j * GRID_SIZE + i].select_set(True)
+
+    mesh = bpy.data.meshes.new("perfect_select_grid")
+    bm.to_mesh(mesh)
+    try:
+        mesh_topology = topology.MeshTopology(mesh)
+        face_select = topology.foreach_get_array(mesh.polygons, "select", bool)
+        boundary_edges = select.get_region_to_loop_edges(mesh_topology, face_select)
+        loop_edges = select.get_loop_edges(mesh_topology, boundary_edges)
+        select.select_faces_in_boundary_loop(bm, mesh_topology, face_select, boundary_edges, loop_edges)
+        return {(f.index % GRID_SIZE, f.index // GRID_SIZE) for f in bm.faces if f.select}
+    finally:
+        bm.free()
+        bpy.data.meshes.remove(mesh)
+
+
+def test_block_with_bump():
+    assert reduce_to_boundary_loops(block(2, 2, 3, 3) | {(3, 5)}) == block(2, 2, 3, 3)
+
+
+def test_block_with_side_face():
+    assert reduce_to_boundary_loops(block(1, 1, 5, 5) | {(6, 3)}) == block(1, 1, 5, 5)
+
+
+def test_block_with_wide_arm():
+    assert reduce_to_boundary_loops(block(1, 1, 5, 3) | block(2, 4, 2, 2)) == block(1, 1, 5, 3)
+
+
+def test_block_unchanged():
+    assert reduce_to_boundary_loops(block(1, 1, 4, 3)) == block(1, 1, 4, 3)
+
+
+@pytest.mark.parametrize("bump", [(2, 5), (4, 5)])
+def test_block_with_corner_bump(bump):
+    assert reduce_to_boundary_loops(block(2, 2, 3, 3) | {bump}) == block(2, 2, 3, 3)
+
+
+def test_block_with_two_bumps():
+    assert reduce_to_boundary_loops(block(2, 2, 5, 3) | {(2, 5), (5, 5)}) == block(2, 2, 5, 3)
+
+
+def test_plus():
+    arms = {(4, 6), (4, 2), (2, 4), (6, 4)}
+    assert reduce_to_boundary_loops(block(3, 3, 3, 3) | arms) == block(3, 3, 3, 3)
+
+
+def test_block_with_opposite_bumps():
+    assert reduce_to_boundary_loops(block(2, 2, 5, 5) | {(4, 7), (4, 1)}) == block(2, 2, 5, 5)
+
+
+def test_block_with_crossing_arm():
+    assert reduce_to_boundary_loops(block(2, 2, 4, 4) | block(3, 0, 1, 8)) == block(2, 2, 4, 4)
+
+
+def test_block_with_hole_unchanged():
+    faces = block(1, 1, 5, 5) - {(3, 3)}
+    assert reduce_to_boundary_loops(faces) == faces